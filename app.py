@@ -1,18 +1,39 @@
+import bisect
+import bz2
+import codecs
 import csv
+import gzip
+import hashlib
+import heapq
+import json
+import lzma
+import mimetypes
+import mmap
+import multiprocessing
 import os
-from io import BytesIO
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash, make_response
-from collections import defaultdict
-from openpyxl import Workbook
+import re
+import struct
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from flask import Flask, Response, render_template, request, send_file, redirect, url_for, flash, make_response, jsonify
+from array import array
+from collections import OrderedDict, defaultdict
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Alignment, numbers
 from openpyxl.styles.numbers import FORMAT_CURRENCY_USD_SIMPLE
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 from weasyprint import HTML
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, make_transient_to_detached
 from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dateutil.parser import parse as date_parse
 from difflib import get_close_matches
 from functools import wraps
@@ -21,10 +42,21 @@ from dotenv import load_dotenv
 from flask_babel import Babel, _, lazy_gettext as _l
 from flask import session
 import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer
 import logging
 from flask import send_from_directory
+
+try:
+    import numpy as np
+except ImportError:  # optional, without it every file uses the row loop
+    np = None
+try:
+    import brotli
+except ImportError:  # gzip only then
+    brotli = None
 from flask_talisman import Talisman
 
 logging.basicConfig(level=logging.INFO)
@@ -49,11 +81,47 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+# rendered xlsx/pdf exports, reused until the summary changes
+EXPORT_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'exports')
+os.makedirs(EXPORT_CACHE_FOLDER, exist_ok=True)
+app.config['EXPORT_CACHE_MAX_BYTES'] = int(os.getenv('EXPORT_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+
+# summaries in a fixed columnar layout, mmapped by every worker
+SUMMARY_STORE_FOLDER = os.path.join(UPLOAD_FOLDER, 'summaries')
+os.makedirs(SUMMARY_STORE_FOLDER, exist_ok=True)
+app.config['SUMMARY_STORE_MAX_BYTES'] = int(os.getenv('SUMMARY_STORE_MAX_BYTES', 500 * 1024 * 1024))
+
+# chunked uploads for big csv files
+CHUNK_FOLDER = os.path.join(UPLOAD_FOLDER, 'chunks')
+os.makedirs(CHUNK_FOLDER, exist_ok=True)
+CHUNK_SIZE = 5 * 1024 * 1024
+CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024  # files bigger than this go through /upload/chunked
+CHUNKED_UPLOAD_MAX_AGE = 24 * 60 * 60
+# uploads are parsed straight from the request, set this to also keep the
+# raw file in the blob store (download_old_report can rebuild from it)
+app.config['KEEP_RAW_UPLOADS'] = os.getenv('KEEP_RAW_UPLOADS', 'false').lower() == 'true'
+
+# outcome of background preview jobs, one small json file per job, so
+# whichever worker serves the owner next can pick it up
+SUMMARY_JOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')
+os.makedirs(SUMMARY_JOB_FOLDER, exist_ok=True)
+
+# content addressed store for kept raw uploads and payment proofs
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')
+os.makedirs(BLOB_FOLDER, exist_ok=True)
+app.config['BLOB_STORE_MAX_BYTES'] = int(os.getenv('BLOB_STORE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+app.config['RAW_UPLOAD_MAX_AGE_DAYS'] = int(os.getenv('RAW_UPLOAD_MAX_AGE_DAYS', 90))
+app.config['PROOF_MAX_AGE_DAYS'] = int(os.getenv('PROOF_MAX_AGE_DAYS', 365))
+app.config['BLOB_GC_INTERVAL'] = int(os.getenv('BLOB_GC_INTERVAL', 60 * 60))  # 0 turns the gc thread off
+# let the front server send blobs: '', 'x-sendfile' or 'x-accel-redirect'
+app.config['BLOB_OFFLOAD'] = os.getenv('BLOB_OFFLOAD', '').lower()
+app.config['BLOB_ACCEL_PREFIX'] = os.getenv('BLOB_ACCEL_PREFIX', '/_blobs/')
 app.config['BABEL_SUPPORTED_LOCALES'] = ['en', 'ms', 'id', 'zh_Hans'] 
 app.config.update(
-    MAIL_SERVER='smtp.gmail.com', 
-    MAIL_PORT=587,
-    MAIL_USE_TLS=True,
+    MAIL_SERVER=os.getenv('MAIL_SERVER', 'smtp.gmail.com'),
+    MAIL_PORT=int(os.getenv('MAIL_PORT', 587)),
+    MAIL_USE_TLS=os.getenv('MAIL_USE_TLS', 'true').lower() == 'true',
     MAIL_USERNAME=os.getenv('MAIL_USERNAME'),
     MAIL_PASSWORD=os.getenv('MAIL_PASSWORD'),
     MAIL_DEFAULT_SENDER=os.getenv('MAIL_DEFAULT_SENDER')
@@ -66,6 +134,12 @@ csp = {
     'script-src': ["'self'", "'unsafe-inline'"]
 }
 
+# behind nginx/a load balancer set TRUSTED_PROXIES to how many proxies sit in
+# front, so remote_addr and the scheme come from their X-Forwarded-* headers
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
 Talisman(app, content_security_policy=csp)
 
 mail = Mail(app) 
@@ -76,6 +150,9 @@ migrate = Migrate(app, db)
 latest_summary = None  
 latest_mode = "date"
 
+chunked_uploads = {}
+chunked_uploads_lock = threading.Lock()
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -88,6 +165,8 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.Text, nullable=False)
     plan = db.Column(db.String(20), default="free")
     is_admin = db.Column(db.Boolean, default=False)
+    # kept in step with the upload table so the free plan check isn't a COUNT
+    upload_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 
 class Upload(db.Model):
@@ -105,6 +184,24 @@ class FileSummary(db.Model):
     summary_text = db.Column(db.Text)
     generated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# resolved delimiter + column positions for a header line we've seen before,
+# user_id is set for a user's own override and wins over the shared layout.
+# only a user's own override carries a date format, shared rows leave it to
+# detection since two users can send the same header with different formats
+class HeaderLayout(db.Model):
+    __table_args__ = (db.UniqueConstraint('signature', 'user_id', name='uq_header_layout_signature_user'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.String(64), nullable=False, index=True)
+    header = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    delimiter = db.Column(db.String(1), nullable=False)
+    date_col = db.Column(db.Integer, nullable=False)
+    item_col = db.Column(db.Integer, nullable=False)
+    amount_col = db.Column(db.Integer, nullable=False)
+    date_format = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class PaymentRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -112,10 +209,46 @@ class PaymentRequest(db.Model):
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     currency = db.Column(db.String(3), default='BND', nullable=False)
     proof_filename = db.Column(db.String(256), nullable=True)
+    # set for proofs in the blob store, older ones are files in UPLOAD_FOLDER named proof_filename
+    proof_blob = db.Column(db.String(64), db.ForeignKey('blob.sha256'), nullable=True)
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# running totals for the admin page, a single row (id 1)
+class SiteStats(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)  # admins aren't counted
+    premium_users = db.Column(db.Integer, nullable=False, default=0)
+    uploads = db.Column(db.Integer, nullable=False, default=0)
+    sales_total = db.Column(db.Float, nullable=False, default=0.0)
+    pending_payments = db.Column(db.Integer, nullable=False, default=0)
+    approved_payments = db.Column(db.Integer, nullable=False, default=0)
+    rejected_payments = db.Column(db.Integer, nullable=False, default=0)
+    approved_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class DailyUploadStats(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    uploads = db.Column(db.Integer, nullable=False, default=0)
+    sales_total = db.Column(db.Float, nullable=False, default=0.0)
+
+# a file in the blob store, refcount is how many upload_file rows and
+# payment requests point at it. updated_at moves with every refcount change
+class Blob(db.Model):
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+# raw files kept for an upload (KEEP_RAW_UPLOADS), a batch or appends can have several
+class UploadFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), nullable=False, index=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 # admin credentials
 def create_admin_user():
@@ -127,7 +260,7 @@ def create_admin_user():
         admin = User(
             username="admin",
             email="admin@example.com",
-            password_hash=generate_password_hash(admin_password),
+            password_hash=generate_password_hash(admin_password, app.config['PASSWORD_HASH_METHOD']),
             is_admin=True,
             plan="premium"
         )
@@ -135,10 +268,54 @@ def create_admin_user():
         db.session.commit()
 
 
+# cache of the logged in user's row + pending upgrade status, so most
+# requests don't go to the db for them. anything that changes either calls
+# forget_user(), the ttl covers changes made by other workers
+USER_CACHE_TTL = 30
+user_cache = {}
+user_cache_lock = threading.Lock()
+
+def cached_user_entry(user_id):
+    with user_cache_lock:
+        entry = user_cache.get(user_id)
+    if entry and entry['expires'] > time.time():
+        return entry
+    return None
+
+def cache_user(user):
+    columns = {column.name: getattr(user, column.name) for column in User.__table__.columns}
+    with user_cache_lock:
+        user_cache[user.id] = {'expires': time.time() + USER_CACHE_TTL, 'columns': columns, 'pending': None}
+
+def forget_user(user_id):
+    with user_cache_lock:
+        user_cache.pop(user_id, None)
+
 # load users
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    entry = cached_user_entry(user_id)
+    if entry is not None:
+        # rebuild it from the cached columns and attach it without a select
+        user = User(**entry['columns'])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = User.query.get(user_id)
+    if user is not None:
+        cache_user(user)
+    return user
+
+def has_pending_request(user_id):
+    entry = cached_user_entry(user_id)
+    if entry is not None and entry['pending'] is not None:
+        return entry['pending']
+
+    pending = PaymentRequest.query.filter_by(user_id=user_id, status='pending').first() is not None
+    if entry is not None:
+        entry['pending'] = pending
+    return pending
 
 # user can pick any language
 def get_locale():
@@ -174,15 +351,112 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
     
+# admin stats
+# the totals on the admin page are kept in step with the rows they count,
+# in the same transaction as the change, so the page reads one stats row
+# and a few daily rows instead of scanning users/uploads/payments.
+# rebuild_admin_stats() recounts everything with GROUP BY, it runs the
+# first time there's no stats row and from `flask rebuild-admin-stats`
+ADMIN_STATS_DAYS = 30
+ADMIN_PAGE_SIZE = 50
+
+def rebuild_admin_stats():
+    stats = db.session.get(SiteStats, 1)
+    if stats is None:
+        stats = SiteStats(id=1)
+        db.session.add(stats)
+
+    stats.users, stats.premium_users = db.session.query(
+        func.count(User.id), func.coalesce(func.sum(case((User.plan == 'premium', 1), else_=0)), 0)
+    ).filter(User.is_admin.isnot(True)).one()
+    stats.uploads, stats.sales_total = db.session.query(
+        func.count(Upload.id), func.coalesce(func.sum(Upload.total), 0.0)
+    ).one()
+
+    payments = {
+        status: (count, amount)
+        for status, count, amount in db.session.query(
+            PaymentRequest.status, func.count(PaymentRequest.id), func.coalesce(func.sum(PaymentRequest.amount), 0)
+        ).group_by(PaymentRequest.status)
+    }
+    stats.pending_payments = payments.get('pending', (0, 0))[0]
+    stats.approved_payments, stats.approved_amount = payments.get('approved', (0, 0))
+    stats.rejected_payments = payments.get('rejected', (0, 0))[0]
+
+    DailyUploadStats.query.delete()
+    upload_day = func.date(Upload.uploaded_at)
+    for day, count, total in db.session.query(
+        upload_day, func.count(Upload.id), func.coalesce(func.sum(Upload.total), 0.0)
+    ).filter(Upload.uploaded_at.isnot(None)).group_by(upload_day):
+        # sqlite hands date() back as text
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        db.session.add(DailyUploadStats(day=day, uploads=count, sales_total=total))
+    db.session.flush()
+    return stats
+
+def increments(model, deltas):
+    return {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items()}
+
+# add deltas to the running totals, uploads/sales_total also go on `day`.
+# call it after making the change, in the same transaction, the caller commits
+def bump_admin_stats(day=None, **deltas):
+    if not SiteStats.query.filter_by(id=1).update(increments(SiteStats, deltas), synchronize_session=False):
+        # nothing to add to yet, counting the tables picks this change up as well
+        try:
+            with db.session.begin_nested():
+                rebuild_admin_stats()
+            return
+        except IntegrityError:
+            # another request made the row first
+            SiteStats.query.filter_by(id=1).update(increments(SiteStats, deltas), synchronize_session=False)
+
+    daily = {name: deltas[name] for name in ('uploads', 'sales_total') if name in deltas}
+    if day is None or not daily:
+        return
+    if DailyUploadStats.query.filter_by(day=day).update(increments(DailyUploadStats, daily), synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(DailyUploadStats(day=day, **{'uploads': 0, 'sales_total': 0.0, **daily}))
+    except IntegrityError:
+        DailyUploadStats.query.filter_by(day=day).update(increments(DailyUploadStats, daily), synchronize_session=False)
+
+@app.cli.command('rebuild-admin-stats')
+def rebuild_admin_stats_command():
+    rebuild_admin_stats()
+    db.session.commit()
+    print("Admin stats rebuilt.")
+
+# one page of a list, newest first. no COUNT, just whether there's a next page
+def admin_page(query, page):
+    page = max(page, 1)
+    rows = query.offset((page - 1) * ADMIN_PAGE_SIZE).limit(ADMIN_PAGE_SIZE + 1).all()
+    return {'rows': rows[:ADMIN_PAGE_SIZE], 'page': page, 'has_next': len(rows) > ADMIN_PAGE_SIZE}
+
 # to admin page
 @app.route('/admin')
 @login_required
 @admin_required
 def admin():
-    users = User.query.all()
-    uploads = Upload.query.all()  # if uploads exist
-    payment_requests = PaymentRequest.query.order_by(PaymentRequest.created_at.desc()).all()
-    return render_template('admin.html', users=users, uploads=uploads, payment_requests=payment_requests)
+    stats = db.session.get(SiteStats, 1)
+    if stats is None:
+        stats = rebuild_admin_stats()
+        db.session.commit()
+    daily_stats = DailyUploadStats.query.order_by(DailyUploadStats.day.desc()).limit(ADMIN_STATS_DAYS).all()
+
+    pages = {
+        name: request.args.get(f'{name}_page', 1, type=int)
+        for name in ('users', 'uploads', 'payments')
+    }
+    users = admin_page(User.query.order_by(User.id.desc()), pages['users'])
+    uploads = admin_page(Upload.query.options(joinedload(Upload.user)).order_by(Upload.id.desc()), pages['uploads'])
+    payment_requests = admin_page(
+        PaymentRequest.query.options(joinedload(PaymentRequest.user)).order_by(PaymentRequest.created_at.desc()),
+        pages['payments'],
+    )
+    return render_template('admin.html', stats=stats, daily_stats=daily_stats, pages=pages,
+                           users=users, uploads=uploads, payment_requests=payment_requests)
 
 # delete a user from admin page
 @app.route('/admin/delete_user/<int:user_id>', methods=['POST'])
@@ -198,12 +472,86 @@ def delete_user(user_id):
         flash("You cannot delete an admin user")
         return redirect(url_for('admin'))
     
+    HeaderLayout.query.filter_by(user_id=user_id).delete()
     db.session.delete(user)
+    bump_admin_stats(users=-1, premium_users=-1 if user.plan == 'premium' else 0)
     db.session.commit()
+    forget_user(user_id)
     
     flash(f"User {user.username} has been deleted.", "success")
     return redirect(url_for('admin'))
 
+# password hashing
+# hashes run in a small thread pool (hashlib drops the GIL while it works), so a
+# burst of logins queues there instead of tying up every request thread. each
+# client ip gets a couple of hashes in flight, past that it's a 429 (see
+# TRUSTED_PROXIES for the real client ip behind a proxy). each account gets its
+# own cap too, so one username can't be hammered from lots of ips at once
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = PASSWORD_HASH_WORKERS * 4
+PASSWORD_HASH_PER_IP = int(os.getenv('PASSWORD_HASH_PER_IP', 2))
+PASSWORD_HASH_PER_ACCOUNT = int(os.getenv('PASSWORD_HASH_PER_ACCOUNT', 2))
+PASSWORD_HASH_WAIT = 5
+
+password_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+password_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+password_hash_clients = defaultdict(int)
+password_hash_accounts = defaultdict(int)
+password_hash_clients_lock = threading.Lock()
+password_hash_prefixes = {}
+
+class PasswordHashBusy(Exception):
+    pass
+
+def run_password_hash(account, fn, *args):
+    client = request.remote_addr or ''
+    account = (account or '').lower()
+    with password_hash_clients_lock:
+        if (password_hash_clients.get(client, 0) >= PASSWORD_HASH_PER_IP
+                or password_hash_accounts.get(account, 0) >= PASSWORD_HASH_PER_ACCOUNT):
+            raise PasswordHashBusy()
+        password_hash_clients[client] += 1
+        password_hash_accounts[account] += 1
+    try:
+        if not password_hash_slots.acquire(timeout=PASSWORD_HASH_WAIT):
+            raise PasswordHashBusy()
+        try:
+            return password_hash_pool.submit(fn, *args).result()
+        finally:
+            password_hash_slots.release()
+    finally:
+        with password_hash_clients_lock:
+            password_hash_clients[client] -= 1
+            if not password_hash_clients[client]:
+                del password_hash_clients[client]
+            password_hash_accounts[account] -= 1
+            if not password_hash_accounts[account]:
+                del password_hash_accounts[account]
+
+def hash_password(password, account):
+    return run_password_hash(account, generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+# method + parameters werkzeug writes for the configured method ("scrypt" -> "scrypt:32768:8:1")
+def password_hash_prefix(account):
+    method = app.config['PASSWORD_HASH_METHOD']
+    if method not in password_hash_prefixes:
+        password_hash_prefixes[method] = run_password_hash(account, generate_password_hash, '', method).split('$', 1)[0]
+    return password_hash_prefixes[method]
+
+def verify_password(user, password):
+    if not run_password_hash(user.username, check_password_hash, user.password_hash, password):
+        return False
+
+    # hashed with older settings, we have the password now so redo it
+    if user.password_hash.split('$', 1)[0] != password_hash_prefix(user.username):
+        user.password_hash = hash_password(password, user.username)
+        db.session.commit()
+        forget_user(user.id)
+    return True
+
+HASH_BUSY_MESSAGE = "Too many sign-in attempts right now, please try again in a moment."
+
 # to signup page
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -216,9 +564,14 @@ def signup():
             flash("Username already exists")
             return redirect(url_for('signup'))
 
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = hash_password(password, username)
+        except PasswordHashBusy:
+            flash(HASH_BUSY_MESSAGE)
+            return render_template('signup.html'), 429
         new_user = User(username=username, email=email, password_hash=hashed_password)
         db.session.add(new_user)
+        bump_admin_stats(users=1)
         db.session.commit()
 
         flash("Signup successful! Please login.", "success")
@@ -234,7 +587,13 @@ def login():
         password = request.form.get('password')
 
         user = User.query.filter_by(username=username).first()
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            valid = bool(user) and verify_password(user, password)
+        except PasswordHashBusy:
+            flash(HASH_BUSY_MESSAGE)
+            return render_template('login.html'), 429
+
+        if valid:
             login_user(user)
             flash("Logged in successfully", "success")
             if user.is_admin:
@@ -251,8 +610,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
-    session.pop('latest_summary', None)
-    session.pop('latest_mode', None)
+    clear_current_summary()
     logout_user()
     flash("Logged out successfully", "success")
     return redirect(url_for('landing'))
@@ -316,8 +674,13 @@ def reset_password(token):
             flash('Please enter a new password', 'warning')
             return redirect(request.url)
 
-        user.password_hash = generate_password_hash(new_password)
+        try:
+            user.password_hash = hash_password(new_password, user.username)
+        except PasswordHashBusy:
+            flash(HASH_BUSY_MESSAGE)
+            return render_template('reset_password.html'), 429
         db.session.commit()
+        forget_user(user.id)
         flash('Your password has been updated. Please login.', 'success')
         return redirect(url_for('login'))
 
@@ -332,15 +695,55 @@ DATE_HEADERS = ['date', 'Date', 'Date of Sale', 'sale_date']
 ITEM_HEADERS = ['item', 'Item', 'product', 'Product Name']
 AMOUNT_HEADERS = ['amount', 'Amount', 'total', 'Total Sales']
 
+READ_CHUNK_SIZE = 64 * 1024
+
+# combined summaries with more keys than this are aggregated on disk by
+# main.py. uploads don't spill: their summary is stored as one json text and
+# kept in the session, so it would only be merged back into memory
+app.config['COMBINED_MEMORY_BUDGET'] = int(os.getenv('COMBINED_MEMORY_BUDGET', 500000))
+SPILL_FOLDER = os.getenv('SPILL_FOLDER') or None
+
+# files with this many rows are aggregated with numpy (if it's installed)
+app.config['VECTORIZE_MIN_ROWS'] = int(os.getenv('VECTORIZE_MIN_ROWS', 50000))
+VECTOR_BLOCK_ROWS = 100000
+
+# sum amounts as whole cents so long files don't pick up float drift
+app.config['EXACT_CENTS'] = os.getenv('EXACT_CENTS', 'false').lower() == 'true'
+
+# zip / multi file uploads
+MAX_BATCH_FILES = 200
+BATCH_WORKERS = os.cpu_count() or 1
+# checked against the zip's directory before anything is read out of it
+MAX_ZIP_MEMBERS = 1000
+app.config['MAX_ZIP_UNCOMPRESSED_BYTES'] = int(os.getenv('MAX_ZIP_UNCOMPRESSED_BYTES', 1024 * 1024 * 1024))
+# one pool for the process, its workers come from a forkserver (spawn where
+# there's none) so nothing is forked from the threaded web server
+batch_pool = ProcessPoolExecutor(
+    max_workers=BATCH_WORKERS,
+    mp_context=multiprocessing.get_context(
+        'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'),
+)
+
+# compressed csv uploads (name.csv.gz etc), decompressed while they're read
+COMPRESSED_UPLOADS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+CSV_SUFFIXES = ('.csv',) + tuple('.csv' + suffix for suffix in COMPRESSED_UPLOADS)
+
 
 # auto dtect date
-def parse_date_flexible(date_str):
-    date_formats = [
-        "%d/%m/%Y", "%Y-%m-%d", "%m/%d/%Y", "%d-%m-%Y",
-        "%Y/%m/%d", "%Y.%m.%d", "%d %b %Y", "%d %B %Y"
-    ]
+DATE_FORMATS = [
+    "%d/%m/%Y", "%Y-%m-%d", "%m/%d/%Y", "%d-%m-%Y",
+    "%Y/%m/%d", "%Y.%m.%d", "%d %b %Y", "%d %B %Y"
+]
+
+# preferred_format is tried first, a file's dates are locked to the format of its first one
+def parse_date_flexible(date_str, preferred_format=None):
+    if preferred_format:
+        try:
+            return datetime.strptime(date_str.strip(), preferred_format).date()
+        except ValueError:
+            pass
 
-    for fmt in date_formats:
+    for fmt in DATE_FORMATS:
         try:
             return datetime.strptime(date_str.strip(), fmt).date()
         except ValueError:
@@ -352,6 +755,97 @@ def parse_date_flexible(date_str):
     except Exception:
         raise ValueError(f"Date '{date_str}' is not in a recognized format")
 
+def detect_date_format(date_str):
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(date_str.strip(), fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+# amounts like "$1,234.50", "1.234,50" or "BND 12.00"
+# the format is worked out once per file from a sample of the amount column,
+# after that each value is a marker strip, one str.translate + float. files
+# float() can read as they are keep using plain float()
+AMOUNT_SAMPLE_ROWS = 200
+AMOUNT_SPACES = " \xa0\u202f'"
+AMOUNT_SYMBOLS = "$€£¥₹"
+AMOUNT_CODE = re.compile(r'[A-Z]{3}')
+
+def amount_parts(text):
+    digits = [i for i, c in enumerate(text) if c.isdigit()]
+    if not digits:
+        return None
+    return text[:digits[0]], text[digits[0]:digits[-1] + 1], text[digits[-1] + 1:]
+
+# text around the digits that's a currency, a symbol or an iso code like BND.
+# anything else ("12abc") isn't stripped and the value fails like it always did
+def currency_marker(text):
+    text = text.strip(AMOUNT_SPACES + '+-()')
+    if text and (all(c in AMOUNT_SYMBOLS for c in text) or AMOUNT_CODE.fullmatch(text)):
+        return text
+    return ''
+
+def amount_parser(samples):
+    votes = {'.': 0, ',': 0}
+    markers = set()
+    plain = True
+    for text in samples:
+        text = text.strip()
+        try:
+            float(text)
+        except ValueError:
+            plain = False
+        parts = amount_parts(text)
+        if parts is None:
+            continue
+        prefix, core, suffix = parts
+        if any(not c.isdigit() and c not in '.,' + AMOUNT_SPACES for c in core):
+            continue
+        markers.add(currency_marker(prefix))
+        markers.add(currency_marker(suffix))
+
+        if '.' in core and ',' in core:
+            votes[max('.,', key=core.rfind)] += 1
+        elif '.' in core or ',' in core:
+            sep = '.' if '.' in core else ','
+            if core.count(sep) > 1:
+                votes[',' if sep == '.' else '.'] += 1
+            elif len(core) - core.rfind(sep) - 1 != 3:
+                votes[sep] += 1
+            # one separator with three digits after it could be either
+
+    if plain:
+        return float
+
+    decimal = ',' if votes[','] > votes['.'] else '.'
+    thousands = '.' if decimal == ',' else ','
+    table = str.maketrans({c: None for c in AMOUNT_SPACES + thousands})
+    if decimal == ',':
+        table[ord(',')] = '.'
+
+    # markers come off whole and only at either end ("BND 12", "12 €", "-$3"),
+    # so "N12" in a BND file still fails instead of reading as 12
+    ends = tuple(sorted((markers | set(AMOUNT_SYMBOLS)) - {''}, key=len, reverse=True))
+
+    def strip_markers(text):
+        text = text.strip()
+        sign = text[:1] if text[:1] in ('+', '-') else ''
+        body = text[len(sign):].lstrip(AMOUNT_SPACES)
+        if body.startswith(ends):
+            body = body[len(next(m for m in ends if body.startswith(m))):]
+        if body.endswith(ends):
+            body = body[:-len(next(m for m in ends if body.endswith(m)))]
+        return sign + body
+
+    def parse(text):
+        cleaned = strip_markers(text)
+        if cleaned[:1] == '(' and cleaned[-1:] == ')':
+            return -float(strip_markers(cleaned[1:-1]).translate(table))
+        return float(cleaned.translate(table))
+    return parse
+
 # auto detection for header
 def detect_column(headers, candidates):
     headers_clean = [h.strip().lower() for h in headers]
@@ -364,6 +858,120 @@ def detect_column(headers, candidates):
             return headers[index]
     return None
 
+# compact summary: day ordinals, interned item codes and amounts in typed
+# arrays instead of a dict of date/tuple keys. items() still hands out
+# date / item / (date, item) keys so templates and reports work unchanged
+class ColumnarSummary:
+    def __init__(self, mode, days=None, codes=None, amounts=None, item_names=None):
+        self.mode = mode
+        self.days = days if days is not None else array('i')
+        self.codes = codes if codes is not None else array('i')
+        self.amounts = amounts if amounts is not None else array('d')
+        self.item_names = item_names if item_names is not None else []
+        # name -> code, only built once something is appended
+        self._item_codes = None
+
+    @classmethod
+    def from_items(cls, items, mode):
+        summary = cls(mode)
+        for key, amount in items:
+            summary.append(key, amount)
+        return summary
+
+    def item_code(self, item):
+        if self._item_codes is None:
+            self._item_codes = {name: code for code, name in enumerate(self.item_names)}
+        code = self._item_codes.get(item)
+        if code is None:
+            code = self._item_codes[item] = len(self.item_names)
+            self.item_names.append(item)
+        return code
+
+    def append(self, key, amount):
+        if self.mode == "date":
+            self.days.append(key.toordinal())
+        elif self.mode == "item":
+            self.codes.append(self.item_code(key))
+        else:
+            self.days.append(key[0].toordinal())
+            self.codes.append(self.item_code(key[1]))
+        self.amounts.append(amount)
+
+    def key_at(self, index):
+        if self.mode == "date":
+            return date.fromordinal(self.days[index])
+        elif self.mode == "item":
+            return self.item_names[self.codes[index]]
+        return (date.fromordinal(self.days[index]), self.item_names[self.codes[index]])
+
+    def keys(self):
+        return (self.key_at(i) for i in range(len(self.amounts)))
+
+    def values(self):
+        return iter(self.amounts)
+
+    def items(self):
+        return zip(self.keys(), self.amounts)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __bool__(self):
+        return len(self.amounts) > 0
+
+    def total(self):
+        return sum(self.amounts)
+
+    def _take(self, indexes):
+        return ColumnarSummary(
+            self.mode,
+            array('i', (self.days[i] for i in indexes)) if self.days else None,
+            array('i', (self.codes[i] for i in indexes)) if self.codes else None,
+            array('d', (self.amounts[i] for i in indexes)),
+            self.item_names,
+        )
+
+    # same order as sort_summary, or biggest amounts first with by_amount
+    def sorted(self, by_amount=False):
+        indexes = range(len(self.amounts))
+        names = self.item_names
+        if by_amount:
+            order = sorted(indexes, key=self.amounts.__getitem__, reverse=True)
+        elif self.mode == "date":
+            order = sorted(indexes, key=self.days.__getitem__)
+        elif self.mode == "item":
+            lowered = [name.lower() for name in names]
+            order = sorted(indexes, key=lambda i: lowered[self.codes[i]])
+        else:
+            lowered = [name.lower() for name in names]
+            order = sorted(indexes, key=lambda i: (self.days[i], lowered[self.codes[i]]))
+        return self._take(order)
+
+    # rows between two dates (inclusive), expects a date sorted summary
+    def slice(self, from_date=None, to_date=None):
+        if self.mode == "item":
+            raise ValueError("Summaries by item have no dates to slice on")
+        start = bisect.bisect_left(self.days, from_date.toordinal()) if from_date else 0
+        end = bisect.bisect_right(self.days, to_date.toordinal()) if to_date else len(self.days)
+        return ColumnarSummary(
+            self.mode,
+            self.days[start:end],
+            self.codes[start:end] if self.codes else None,
+            self.amounts[start:end],
+            self.item_names,
+        )
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+# "dd-mm-yyyy" -> day ordinal without going through strptime
+def serialized_day(text):
+    return date(int(text[6:10]), int(text[3:5]), int(text[0:2])).toordinal()
+
 # menganu summary glblity
 def serialize_summary(summary, mode):
     if mode == "date":
@@ -371,34 +979,195 @@ def serialize_summary(summary, mode):
     elif mode == "combined":
         return {f"{key[0].strftime('%d-%m-%Y')}|{key[1]}": val for key, val in summary.items()}
     else:  # item
-        return summary
+        return dict(summary.items())
 
+# the session json comes back with its keys in string order, so re-sort
 def deserialize_summary(serialized, mode):
+    summary = ColumnarSummary(mode)
     if mode == "date":
-        return {datetime.strptime(k, "%d-%m-%Y").date(): v for k, v in serialized.items()}
+        for k, v in serialized.items():
+            summary.days.append(serialized_day(k))
+            summary.amounts.append(v)
     elif mode == "combined":
-        result = {}
         for k, v in serialized.items():
             date_str, item = k.split("|", 1)
-            result[(datetime.strptime(date_str, "%d-%m-%Y").date(), item)] = v
-        return result
+            summary.days.append(serialized_day(date_str))
+            summary.codes.append(summary.item_code(item))
+            summary.amounts.append(v)
     else:
-        return serialized
+        for k, v in serialized.items():
+            summary.codes.append(summary.item_code(k))
+            summary.amounts.append(v)
+    return summary.sorted()
     
  # meganu2
+# the version is a digest of the summary itself, pages and exports built
+# from it are cached on that
+def summary_digest(summary_text, mode):
+    return hashlib.sha256(f"{mode}:{summary_text}".encode('utf-8')).hexdigest()
+
+def set_current_summary(serialized, mode):
+    # a newer summary wins over a preview that's still being finished
+    session.pop('summary_job', None)
+    session['latest_summary'] = serialized
+    session['latest_mode'] = mode
+    # same text record_upload stores, so the upload's saved report shares the cache entry
+    session['summary_version'] = summary_digest(json.dumps(serialized), mode)
+    session['summary_updated'] = int(time.time())
+
+def current_summary_version():
+    if 'summary_version' not in session and session.get('latest_summary'):
+        set_current_summary(session['latest_summary'], session.get('latest_mode', 'date'))
+    return session.get('summary_version')
+
+def clear_current_summary():
+    for key in ('latest_summary', 'latest_mode', 'summary_version', 'summary_updated', 'summary_job'):
+        session.pop(key, None)
+
 def get_current_summary():
     serialized = session.get("latest_summary")
     mode = session.get("latest_mode", "date")
     if not serialized:
         return None, mode
-    return deserialize_summary(serialized, mode), mode
-
-
-# loader sales data1
-def load_sales_data(file_stream, mode="date", from_date=None, to_date=None):
-    sales = defaultdict(float)
+    return load_summary(current_summary_version(), mode, lambda: serialized), mode
+
+
+# summary store
+# one file per summary version: a fixed header, then amounts (float64),
+# day ordinals and item codes (int32) and the item dictionary as offsets
+# plus utf-8 bytes. files are written once and opened with mmap, the arrays
+# are memoryviews straight onto the mapping so every worker reads the same
+# page cache and nothing is parsed. byte order is the machine's own
+SUMMARY_FILE_MAGIC = b'SVCOLS01'
+SUMMARY_FILE_HEADER = struct.Struct('=8sB7xQQQ')  # magic, mode, rows, items, name bytes
+SUMMARY_FILE_MODES = ['date', 'item', 'combined']
+SUMMARY_FILE_CACHE_SIZE = 128
+summary_files = OrderedDict()
+summary_files_lock = threading.Lock()
+
+def write_summary_file(path, summary):
+    names = [name.encode('utf-8') for name in summary.item_names]
+    offsets = array('I', [0])
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SUMMARY_FILE_HEADER.pack(SUMMARY_FILE_MAGIC, SUMMARY_FILE_MODES.index(summary.mode),
+                                         len(summary), len(names), offsets[-1]))
+        f.write(array('d', summary.amounts).tobytes())
+        if summary.mode != 'item':
+            f.write(array('i', summary.days).tobytes())
+        if summary.mode != 'date':
+            f.write(array('i', summary.codes).tobytes())
+        f.write(offsets.tobytes())
+        f.write(b''.join(names))
+    os.replace(tmp_path, path)
+
+def open_summary_file(path):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, mode_index, rows, item_count, name_bytes = SUMMARY_FILE_HEADER.unpack_from(view)
+    if magic != SUMMARY_FILE_MAGIC:
+        raise ValueError(f"{path} is not a summary file")
+    mode = SUMMARY_FILE_MODES[mode_index]
+    columns = (mode != 'item') + (mode != 'date')
+    if len(view) != SUMMARY_FILE_HEADER.size + rows * (8 + 4 * columns) + 4 * (item_count + 1) + name_bytes:
+        raise ValueError(f"{path} is truncated")
+
+    def take(size, fmt=None):
+        nonlocal pos
+        part = view[pos:pos + size]
+        pos += size
+        return part.cast(fmt) if fmt else part
+
+    pos = SUMMARY_FILE_HEADER.size
+    amounts = take(8 * rows, 'd')
+    days = take(4 * rows, 'i') if mode != 'item' else None
+    codes = take(4 * rows, 'i') if mode != 'date' else None
+    offsets = take(4 * (item_count + 1), 'I')
+    blob = take(name_bytes)
+    names = [str(blob[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(item_count)]
+    return ColumnarSummary(mode, days, codes, amounts, names)
+
+# the summary for a version, from this process's open files, the mapped
+# file, or serialized() (json) which is then written out for next time
+def load_summary(version, mode, serialized):
+    with summary_files_lock:
+        summary = summary_files.get(version)
+        if summary is not None:
+            summary_files.move_to_end(version)
+            return summary
+
+    path = os.path.join(SUMMARY_STORE_FOLDER, f"{version}.col")
+    try:
+        summary = open_summary_file(path)
+        os.utime(path)
+    except (FileNotFoundError, ValueError, struct.error):
+        summary = deserialize_summary(serialized(), mode)
+        write_summary_file(path, summary)
+        prune_cache_folder(SUMMARY_STORE_FOLDER, app.config['SUMMARY_STORE_MAX_BYTES'], keep=path)
+        try:
+            summary = open_summary_file(path)
+        except FileNotFoundError:
+            # another worker pruned it already, the one just built does fine
+            pass
+
+    with summary_files_lock:
+        summary_files[version] = summary
+        while len(summary_files) > SUMMARY_FILE_CACHE_SIZE:
+            summary_files.popitem(last=False)
+    return summary
+
+
+# feeds csv bytes in as they arrive and keeps the running totals,
+# so uploads don't have to be fully read before parsing starts
+class SalesAggregator:
+    SNIFF_BYTES = 2048
+
+    def __init__(self, mode="date", from_date=None, to_date=None, max_keys=None, vectorize_rows=None,
+                 layout_lookup=None, exact_cents=False):
+        self.mode = mode
+        self.from_date = from_date
+        self.to_date = to_date
+        self.sales = defaultdict(float)
+        # combined mode spills sorted runs to disk past this many keys
+        self.max_keys = max_keys if mode == "combined" else None
+        self._runs = []
+        # files with at least vectorize_rows rows go through numpy instead,
+        # rows are held back until we know which side of that we're on
+        self.vectorize_rows = vectorize_rows if np is not None else None
+        self._buffering = bool(self.vectorize_rows)
+        self._pending = []
+        self._vector = None
+        self.skipped_rows = 0
+        # lines/rows seen so far (header and blank lines included), for progress
+        self.rows_read = 0
+        self.headers = None
+        self.extra_cols = []
+        self.delimiter = None
+        # known header lines skip sniffing and column detection,
+        # layout_lookup(header_line) returns a cached layout or None
+        self.layout_lookup = layout_lookup
+        self.layout = None
+        self.header_line = None
+        # None until the first valid date, '' if no fixed format fits it
+        self.date_format = None
+        # amount format comes from the first rows, which wait in _sample_rows.
+        # a file that looked plain gets another look at the first odd amount
+        # that a new format can read, bad values on the way there are skipped
+        self.parse_amount = float
+        self.amount_samples = None
+        self.amount_misses = 0
+        self._sample_rows = []
+        # add up whole cents instead of floats
+        self.exact_cents = exact_cents
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
 
     # detect delimiter
+    @staticmethod
     def detect_delimiter(sample):
         sniffer = csv.Sniffer()
         try:
@@ -406,75 +1175,800 @@ def load_sales_data(file_stream, mode="date", from_date=None, to_date=None):
             return dialect.delimiter
         except csv.Error:
             return ','
-        
-    file_stream.seek(0)
-    sample = file_stream.read(2048).decode('utf-8')
-    delimiter = detect_delimiter(sample)
 
-    file_stream.seek(0)
-    lines = file_stream.read().decode('utf-8').splitlines()
-    reader = csv.DictReader(lines, delimiter=delimiter)
+    def match_layout(self, final=False):
+        ends = [i for i in (self._buffer.find('\n'), self._buffer.find('\r')) if i >= 0]
+        if not ends and not final:
+            return
+        self.header_line = self._buffer[:min(ends)] if ends else self._buffer
+        layout = self.layout_lookup(self.header_line) if self.header_line.strip() else None
+        if layout:
+            self.layout = layout
+            self.delimiter = layout['delimiter']
+            self.date_format = layout['date_format']
+
+    def feed(self, data):
+        self._buffer += self._decoder.decode(data)
+
+        if self.delimiter is None and self.layout_lookup and self.header_line is None:
+            self.match_layout()
+
+        # wait for enough text to sniff the delimiter
+        if self.delimiter is None:
+            if len(self._buffer) < self.SNIFF_BYTES:
+                return
+            self.delimiter = self.detect_delimiter(self._buffer[:self.SNIFF_BYTES])
+
+        lines = self._buffer.splitlines(keepends=True)
+        # last line may still be incomplete
+        if lines and not lines[-1].endswith(('\n', '\r')):
+            self._buffer = lines.pop()
+        else:
+            self._buffer = ''
+        self._consume_lines(lines)
+
+    def close(self):
+        self._buffer += self._decoder.decode(b'', final=True)
+        if self.delimiter is None and self.layout_lookup and self.header_line is None:
+            self.match_layout(final=True)
+        if self.delimiter is None:
+            self.delimiter = self.detect_delimiter(self._buffer[:self.SNIFF_BYTES])
+        lines = self._buffer.splitlines()
+        self._buffer = ''
+        self._consume_lines(lines)
+        if self._sample_rows is not None:
+            self._release_sample()
+        self._flush()
+        if self._vector is not None:
+            self.sales = self._vector.to_sales()
+            self._vector = None
+        if self.exact_cents and not self._runs:
+            self.sales = defaultdict(float, {key: cents / 100 for key, cents in self.sales.items()})
+
+        if self.headers is None:
+            raise ValueError("The file is empty")
+        return self
+
+    def _consume_lines(self, lines):
+        if not lines:
+            return
+        self.rows_read += len(lines)
+        self._consume_rows(csv.reader((line.rstrip('\r\n') for line in lines), delimiter=self.delimiter))
+
+    # rows that are already split into cells (excel sheets). the header
+    # layout lookup sees the header cells joined with commas. a saved date
+    # format isn't used, date cells come in as yyyy-mm-dd and text dates are
+    # detected like in any other file
+    def feed_rows(self, rows):
+        self.delimiter = ','
+        rows = iter(rows)
+        if self.headers is None and self.layout_lookup and self.header_line is None:
+            values = next((values for values in rows if values), None)
+            if values is None:
+                return
+            self.header_line = ','.join(values)
+            layout = self.layout_lookup(self.header_line)
+            if layout:
+                self.layout = layout
+            self._consume_rows([values])
+        self._consume_rows(rows)
+
+    def _consume_rows(self, rows):
+        for values in rows:
+            if not values:
+                continue
+            if self.headers is None:
+                self.set_headers(values)
+            elif self._sample_rows is not None:
+                self._sample_rows.append(values)
+                if len(self._sample_rows) >= AMOUNT_SAMPLE_ROWS:
+                    self._release_sample()
+            else:
+                self.add_row(values)
+
+    def _release_sample(self):
+        rows, self._sample_rows = self._sample_rows, None
+        if self.headers is None:
+            return
+        samples = [values[self._amount_idx] for values in rows if len(values) > self._amount_idx]
+        self.parse_amount = amount_parser(samples)
+        if self.parse_amount is float:
+            self.amount_samples = samples
+        for values in rows:
+            self.add_row(values)
+
+    # an amount float() can't read in a file that looked plain,
+    # true if that turned up a format the row should be retried with
+    def redetect_amount(self, text):
+        if self.amount_samples is None or not any(c.isdigit() for c in text):
+            return False
+        parser = amount_parser(self.amount_samples + [text])
+        try:
+            parser(text)
+        except ValueError:
+            # just a bad value, stop looking after a sample's worth of them
+            self.amount_misses += 1
+            if self.amount_misses >= AMOUNT_SAMPLE_ROWS:
+                self.amount_samples = None
+            return False
+        self.parse_amount, self.amount_samples = parser, None
+        return True
+
+    def set_headers(self, headers):
+        self.headers = headers
+        if self.layout and max(self.layout['columns']) < len(headers):
+            self._date_idx, self._item_idx, self._amount_idx = self.layout['columns']
+            required_cols = {headers[i] for i in self.layout['columns']}
+            self.extra_cols = [h for h in headers if h not in required_cols]
+            return
+
+        # auto detect columns
+        date_col = detect_column(headers, DATE_HEADERS)
+        item_col = detect_column(headers, ITEM_HEADERS)
+        amount_col = detect_column(headers, AMOUNT_HEADERS)
+
+        # identify extra column
+        required_cols = {date_col, item_col, amount_col}
+        self.extra_cols = [h for h in headers if h not in required_cols]
+
+        missing = []
+        if not date_col:
+            missing.append("Date")
+        if not item_col:
+            missing.append("Item")
+        if not amount_col:
+            missing.append("Amount")
+
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+        self._date_idx = headers.index(date_col)
+        self._item_idx = headers.index(item_col)
+        self._amount_idx = headers.index(amount_col)
+
+    def add_row(self, values):
+        if not self._buffering:
+            self._add_row_now(values)
+            return
+
+        self._pending.append(values)
+        block_rows = VECTOR_BLOCK_ROWS if self._vector is not None else self.vectorize_rows
+        if len(self._pending) >= block_rows:
+            self._flush()
+
+    def _flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+
+        if self._vector is None and len(rows) >= self.vectorize_rows:
+            self._vector = VectorizedTotals(self.mode, self.from_date, self.to_date, self.exact_cents)
+        if self._vector is None:
+            # small file, the plain loop is quicker
+            self._buffering = False
+            for values in rows:
+                self._add_row_now(values)
+            return
+
+        # short rows would be an IndexError in the loop, so they're invalid too
+        needed = max(self._date_idx, self._item_idx, self._amount_idx) + 1
+        complete = [values for values in rows if len(values) >= needed]
+        self.skipped_rows += len(rows) - len(complete)
+        if not complete:
+            return
+
+        # lock the date format on the same row the loop would have
+        self._vector.redetect_amount = None
+        if self.amount_samples is not None:
+            self._vector.redetect_amount = lambda text: self.parse_amount if self.redetect_amount(text) else None
+        self._vector.parse_amount = self.parse_amount
+        if self.date_format is None:
+            for values in complete:
+                try:
+                    self.parse_amount(values[self._amount_idx])
+                    self.lock_date_format(values[self._date_idx].strip())
+                except ValueError:
+                    continue
+                break
+        self._vector.date_format = self.date_format
+
+        self.skipped_rows += self._vector.add_block(
+            [values[self._date_idx] for values in complete],
+            [values[self._item_idx] for values in complete],
+            [values[self._amount_idx] for values in complete],
+        )
+        if self.max_keys and len(self._vector.keys) > self.max_keys:
+            self.sales = self._vector.to_sales()
+            self._spill()
+            self._vector.reset()
+
+    def _add_row_now(self, values):
+        try:
+            amount = self.parse_amount(values[self._amount_idx])
+        except ValueError:
+            if self.redetect_amount(values[self._amount_idx]):
+                return self._add_row_now(values)
+            self.skipped_rows += 1
+            return
+        except IndexError:
+            self.skipped_rows += 1
+            return
 
+        try:
+            date_text = values[self._date_idx].strip()
+            date_obj = parse_date_flexible(date_text, self.date_format)
+            item = values[self._item_idx].strip()
+        except (ValueError, IndexError):
+            self.skipped_rows += 1
+            return
+
+        if self.exact_cents:
+            amount = round(amount * 100)
+
+        if self.date_format is None:
+            self.lock_date_format(date_text)
+
+        if self.from_date and date_obj < self.from_date:
+            return
+        if self.to_date and date_obj > self.to_date:
+            return
+
+        if self.mode == "date":
+            self.sales[date_obj] += amount
+        elif self.mode == "item":
+            self.sales[item] += amount
+        elif self.mode == "combined":
+            self.sales[(date_obj, item)] += amount
+            if self.max_keys and len(self.sales) > self.max_keys:
+                self._spill()
+
+    # raises ValueError if date_text isn't a date at all
+    def lock_date_format(self, date_text):
+        fmt = detect_date_format(date_text)
+        if fmt is None:
+            parse_date_flexible(date_text)
+        self.date_format = fmt or ''
+
+    # write the current totals out as a sorted run and start over
+    def _spill(self):
+        run = tempfile.TemporaryFile(mode='w+', newline='', encoding='utf-8', dir=SPILL_FOLDER)
+        writer = csv.writer(run)
+        for (date_obj, item), amount in sorted(self.sales.items(), key=spill_sort_key):
+            # cents add up in a float dict, the run is read back with int()
+            writer.writerow((date_obj.toordinal(), item, int(amount) if self.exact_cents else repr(amount)))
+        run.seek(0)
+        self._runs.append(run)
+        self.sales = defaultdict(float)
+
+    def result(self):
+        if self._runs:
+            runs, self._runs = self._runs, []
+            memory_run = sorted(self.sales.items(), key=spill_sort_key)
+            self.sales = defaultdict(float)
+            return SpilledSummary(runs, memory_run, self.exact_cents)
+        return sort_summary(self.sales, self.mode)
+
+
+# numpy engine for big files, a block of rows at a time:
+# dates, items and amounts are factorized with np.unique so each distinct
+# string is parsed once, then np.add.at sums the amounts per key. np.add.at
+# adds row by row in file order, the same order as the dict loop, so the
+# totals (and the skipped row count) come out identical. the one exception is
+# a combined summary that spills: this spills after a block, the loop after a
+# row, so partial sums are grouped differently and float totals can be off in
+# the last few bits. with EXACT_CENTS they're ints and still match
+class VectorizedTotals:
+    def __init__(self, mode, from_date=None, to_date=None, exact_cents=False):
+        self.mode = mode
+        self.exact_cents = exact_cents
+        self.parse_amount = float
+        self.redetect_amount = None
+        self.from_ordinal = from_date.toordinal() if from_date else None
+        self.to_ordinal = to_date.toordinal() if to_date else None
+        self.item_ids = {}
+        self.item_names = []
+        self.date_format = None
+        self.reset()
+
+    def reset(self):
+        self.key_codes = {}
+        self.keys = []
+        self.totals = np.zeros(1024, dtype=np.int64 if self.exact_cents else np.float64)
+
+    def _item_id(self, name):
+        item_id = self.item_ids.get(name)
+        if item_id is None:
+            item_id = self.item_ids[name] = len(self.item_names)
+            self.item_names.append(name)
+        return item_id
+
+    def _parse_amounts(self, unique_amounts):
+        values = np.zeros(len(unique_amounts), dtype=np.float64)
+        ok = np.zeros(len(unique_amounts), dtype=bool)
+        for position, text in enumerate(unique_amounts):
+            try:
+                values[position] = self.parse_amount(text)
+                ok[position] = True
+            except ValueError:
+                pass
+        return values, ok
+
+    def _parse_ordinal(self, text):
+        try:
+            return parse_date_flexible(text.strip(), self.date_format).toordinal()
+        except ValueError:
+            return -1
+
+    # returns how many rows were invalid
+    def add_block(self, dates, items, amounts):
+        unique_amounts, amount_index = np.unique(np.array(amounts), return_inverse=True)
+        unique_amounts = unique_amounts.tolist()
+        amount_values, amount_ok = self._parse_amounts(unique_amounts)
+        row_amounts, row_ok = amount_values[amount_index], amount_ok[amount_index]
+        if self.redetect_amount is not None and not amount_ok.all():
+            # odd amounts in file order, the first one the row loop would pick.
+            # rows before it keep what the old format made of them
+            for row in np.nonzero(~row_ok)[0].tolist():
+                parser = self.redetect_amount(amounts[row])
+                if parser is not None:
+                    self.parse_amount = parser
+                    amount_values, amount_ok = self._parse_amounts(unique_amounts)
+                    row_amounts[row:] = amount_values[amount_index[row:]]
+                    row_ok[row:] = amount_ok[amount_index[row:]]
+                    break
+
+        unique_dates, date_index = np.unique(np.array(dates), return_inverse=True)
+        ordinals = np.array([self._parse_ordinal(text) for text in unique_dates.tolist()], dtype=np.int64)
+
+        row_ordinals = ordinals[date_index]
+        valid = row_ok & (row_ordinals >= 0)
+        skipped = int(len(valid) - np.count_nonzero(valid))
+
+        keep = valid
+        if self.from_ordinal is not None:
+            keep &= row_ordinals >= self.from_ordinal
+        if self.to_ordinal is not None:
+            keep &= row_ordinals <= self.to_ordinal
+        rows = np.nonzero(keep)[0]
+        if not len(rows):
+            return skipped
+
+        if self.mode == "date":
+            local_keys = row_ordinals[rows]
+        else:
+            unique_items, item_index = np.unique(np.array(items), return_inverse=True)
+            item_ids = np.array([self._item_id(text.strip()) for text in unique_items.tolist()], dtype=np.int64)
+            row_items = item_ids[item_index][rows]
+            if self.mode == "item":
+                local_keys = row_items
+            else:
+                local_keys = (row_ordinals[rows] << 32) | row_items
+
+        # new keys get codes in order of first appearance, like dict insertion
+        unique_keys, first_seen, key_index = np.unique(local_keys, return_index=True, return_inverse=True)
+        codes = np.empty(len(unique_keys), dtype=np.int64)
+        for position in np.argsort(first_seen, kind='stable').tolist():
+            key = int(unique_keys[position])
+            code = self.key_codes.get(key)
+            if code is None:
+                code = self.key_codes[key] = len(self.keys)
+                self.keys.append(key)
+            codes[position] = code
+
+        if len(self.keys) > len(self.totals):
+            grow = np.zeros(max(len(self.keys), len(self.totals)), dtype=self.totals.dtype)
+            self.totals = np.concatenate([self.totals, grow])
+        row_amounts = row_amounts[rows]
+        if self.exact_cents:
+            row_amounts = np.rint(row_amounts * 100).astype(np.int64)
+        np.add.at(self.totals, codes[key_index], row_amounts)
+        return skipped
+
+    def _decode(self, key):
+        if self.mode == "date":
+            return date.fromordinal(key)
+        elif self.mode == "item":
+            return self.item_names[key]
+        return (date.fromordinal(key >> 32), self.item_names[key & 0xFFFFFFFF])
+
+    def to_sales(self):
+        sales = defaultdict(float)
+        for code, key in enumerate(self.keys):
+            sales[self._decode(key)] = self.totals[code].item()
+        return sales
+
+
+def item_sort_key(entry):
+    return entry[0].lower()
+
+def combined_sort_key(entry):
+    return (entry[0][0], entry[0][1].lower())
+
+# total order for merging runs, case variants of an item can't tie
+def spill_sort_key(entry):
+    return (entry[0][0], entry[0][1].lower(), entry[0][1])
+
+def sort_summary(sales, mode):
+    if mode == "date":
+        return dict(sorted(sales.items()))
+    elif mode == "item":
+        return dict(sorted(sales.items(), key=item_sort_key))
+    elif mode == "combined":
+        return dict(sorted(sales.items(), key=combined_sort_key))
+
+
+# combined summary that didn't fit in memory, items() k-way merges the
+# sorted runs on disk so it's walked in order without loading it all.
+# close() drops the run files
+class SpilledSummary:
+    def __init__(self, runs, memory_run, cents=False):
+        self._runs = runs
+        self._memory_run = memory_run
+        self._scale = 100 if cents else 1
+        self._length = None
+
+    def _read_run(self, run):
+        run.seek(0)
+        for ordinal, item, amount in csv.reader(run):
+            yield (date.fromordinal(int(ordinal)), item), float(amount) if self._scale == 1 else int(amount)
+
+    def items(self):
+        sources = [self._read_run(run) for run in self._runs] + [iter(self._memory_run)]
+        current_key, current_total = None, 0.0
+        count = 0
+        # the same key can be in several runs, add those up
+        for key, amount in heapq.merge(*sources, key=spill_sort_key):
+            if key == current_key:
+                current_total += amount
+                continue
+            if current_key is not None:
+                count += 1
+                yield current_key, current_total / self._scale
+            current_key, current_total = key, amount
+        if current_key is not None:
+            count += 1
+            yield current_key, current_total / self._scale
+        self._length = count
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (amount for _, amount in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(1 for _ in self.items())
+        return self._length
+
+    def __bool__(self):
+        return bool(self._runs or self._memory_run)
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+
+
+def flash_import_notes(aggregator):
+    if aggregator.extra_cols:
+        flash(f"Ignoring extra columns: {', '.join(aggregator.extra_cols)}")
+    if aggregator.skipped_rows:
+        flash(f"Skipped {aggregator.skipped_rows} invalid rows during import")
+
+
+# the compression suffix of a .csv.gz/.csv.bz2/.csv.xz name, None for plain csv
+def upload_compression(filename):
+    name = filename.lower()
+    for suffix in COMPRESSED_UPLOADS:
+        if name.endswith('.csv' + suffix):
+            return suffix
+    return None
 
-    # auto detect columns
-    headers = reader.fieldnames
-    date_col = detect_column(headers, DATE_HEADERS)
-    item_col = detect_column(headers, ITEM_HEADERS)
-    amount_col = detect_column(headers, AMOUNT_HEADERS)
 
-    # identify extra column
-    required_cols = {date_col, item_col, amount_col}
-    extra_cols = [h for h in headers if h not in required_cols]
+# counts the raw bytes read from an upload, and copies them into tee if given
+class SourceReader:
+    def __init__(self, stream, tee=None):
+        self.stream = stream
+        self.tee = tee
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.tee is not None:
+            self.tee.write(data)
+        return data
+
+
+# ingestion progress
+# parsing publishes its stage and counters to a channel per (user, progress id),
+# /progress/<id> streams them to the upload page as server-sent events.
+# everything is in this process, a channel only keeps its latest state
+PROGRESS_ID = re.compile(r'[0-9a-f]{32}')
+PROGRESS_INTERVAL = 0.25
+PROGRESS_CHANNEL_TTL = 10 * 60
+PROGRESS_KEEPALIVE = 15
+PROGRESS_STREAM_MAX_AGE = 5 * 60
+progress_channels = {}
+progress_condition = threading.Condition()
+
+def publish_progress(key, state):
+    now = time.time()
+    with progress_condition:
+        channel = progress_channels.setdefault(key, {'version': 0})
+        channel['state'] = state
+        channel['version'] += 1
+        channel['updated'] = now
+        if state['stage'] in ('done', 'error'):
+            for stale in [k for k, c in progress_channels.items() if c['updated'] < now - PROGRESS_CHANNEL_TTL]:
+                del progress_channels[stale]
+        progress_condition.notify_all()
+
+# next state after version, (None, version) if nothing new turned up in time
+def wait_for_progress(key, version, timeout):
+    with progress_condition:
+        progress_condition.wait_for(
+            lambda: progress_channels.get(key, {}).get('version', 0) > version, timeout)
+        channel = progress_channels.get(key)
+        if not channel or channel['version'] <= version:
+            return None, version
+        return dict(channel['state']), channel['version']
+
+# one upload's progress, key None (no progress id sent) publishes nothing
+class IngestProgress:
+    def __init__(self, key, total=None):
+        self.key = key
+        self.total = total
+        self.last = 0
+
+    def stage(self, stage, aggregator=None, bytes_read=None, **extra):
+        if self.key is None:
+            return
+        self.last = time.time()
+        state = {'stage': stage, 'bytes_read': bytes_read, 'total_bytes': self.total}
+        if aggregator is not None:
+            state['rows_read'] = aggregator.rows_read
+            state['skipped_rows'] = aggregator.skipped_rows
+        state.update(extra)
+        publish_progress(self.key, state)
+
+    # called per chunk, only publishes every PROGRESS_INTERVAL
+    def update(self, aggregator, bytes_read=None, stage='parsing'):
+        if self.key is not None and time.time() - self.last >= PROGRESS_INTERVAL:
+            self.stage(stage, aggregator, bytes_read)
+
+def ingest_progress(progress_id, total=None):
+    if not progress_id or not PROGRESS_ID.fullmatch(progress_id):
+        return IngestProgress(None, total)
+    return IngestProgress((current_user.id, progress_id), total)
+
+
+# tee gets a copy of the raw (still compressed) bytes when the original file
+# has to be kept. compressed files are decompressed a chunk at a time
+def feed_stream(aggregator, stream, tee=None, compression=None, progress=None):
+    source = stream = SourceReader(stream, tee)
+    if compression:
+        stream = COMPRESSED_UPLOADS[compression](stream)
+    for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b''):
+        aggregator.feed(chunk)
+        if progress is not None:
+            progress.update(aggregator, source.bytes_read)
+    return aggregator.close()
+
+
+# excel cells to the text the csv path would have seen,
+# date cells come out as yyyy-mm-dd, which no day/month order can misread,
+# and trailing empty cells are dropped
+def excel_cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+def excel_row_values(row):
+    values = [excel_cell_text(value) for value in row]
+    while values and not values[-1]:
+        values.pop()
+    return values
+
+# read only mode hands out one row at a time instead of loading the whole workbook
+def feed_workbook(aggregator, stream, progress=None):
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+
+    def rows():
+        for row in workbook.active.iter_rows(values_only=True):
+            aggregator.rows_read += 1
+            if progress is not None:
+                progress.update(aggregator)
+            yield excel_row_values(row)
 
-    if extra_cols:
-        flash(f"Ignoring extra columns: {', '.join(extra_cols)}")
+    try:
+        aggregator.feed_rows(rows())
+    finally:
+        workbook.close()
+    return aggregator.close()
 
-    missing = []
-    if not date_col:
-        missing.append("Date")
-    if not item_col:
-        missing.append("Item")
-    if not amount_col:
-        missing.append("Amount")
 
-    if missing:
-        raise ValueError(f"Missing required columns: {', '.join(missing)}")
-            
-    # if not date_col or not item_col or not amount_col:
-    #     raise ValueError("CSV is missing one or more required columns")
+# loader sales data1
+def load_sales_data(file_stream, mode="date", from_date=None, to_date=None, tee=None, compression=None,
+                    progress=None):
+    aggregator = new_aggregator(mode, from_date, to_date)
 
-    skipped_rows = 0
-    for row in reader:
-        try:
-            amount = float(row[amount_col])
-            date_obj = parse_date_flexible(row[date_col].strip())
-            item = row[item_col].strip()
+    file_stream.seek(0)
+    feed_stream(aggregator, file_stream, tee, compression, progress)
+    if progress is not None:
+        progress.stage('saving', aggregator)
 
-            if from_date and date_obj < from_date:
-                continue
-            if to_date and date_obj > to_date:
-                continue
+    remember_header_layout(aggregator)
+    flash_import_notes(aggregator)
+    return aggregator.result()
 
-            if mode == "date":
-                sales[date_obj] += amount
-            elif mode == "item":
-                sales[item] += amount
-            elif mode == "combined":
-                sales[(date_obj, item)] += amount
-        except (ValueError, KeyError):
-            skipped_rows +=1
-            continue
+def load_sales_workbook(file_stream, mode="date", from_date=None, to_date=None, progress=None):
+    aggregator = new_aggregator(mode, from_date, to_date)
 
-    if skipped_rows:
-        flash(f"Skipped {skipped_rows} invalid rows during import")
+    file_stream.seek(0)
+    feed_workbook(aggregator, file_stream, progress)
+    if progress is not None:
+        progress.stage('saving', aggregator)
+
+    remember_header_layout(aggregator)
+    flash_import_notes(aggregator)
+    return aggregator.result()
+
+def new_aggregator(mode, from_date, to_date):
+    user_id = current_user.id if current_user.is_authenticated else None
+    return SalesAggregator(mode=mode, from_date=from_date, to_date=to_date,
+                           vectorize_rows=app.config['VECTORIZE_MIN_ROWS'],
+                           layout_lookup=lambda header_line: find_header_layout(header_line, user_id),
+                           exact_cents=app.config['EXACT_CENTS'])
+
+# header layout cache
+# integrations send the same few headers over and over, so the resolved
+# delimiter / columns are kept per header line in the db with
+# a small in-process lru in front. entries expire so overrides saved by
+# another worker show up
+HEADER_LAYOUT_CACHE_SIZE = 512
+HEADER_LAYOUT_CACHE_TTL = 300
+header_layout_cache = OrderedDict()
+header_layout_cache_lock = threading.Lock()
+
+def header_signature(header_line):
+    return hashlib.sha256(header_line.lstrip('\ufeff').strip().encode('utf-8')).hexdigest()
+
+def layout_from_row(row):
+    return {
+        'delimiter': row.delimiter,
+        'columns': (row.date_col, row.item_col, row.amount_col),
+        'date_format': row.date_format if row.user_id is not None else None,
+    }
 
-    if mode == "date":
-        return dict(sorted(sales.items()))
-    elif mode == "item":
-        return dict(sorted(sales.items(), key=lambda x: x[0].lower()))
-    elif mode == "combined":
-        return dict(sorted(sales.items(), key=lambda x: (x[0][0], x[0][1].lower())))
+def find_header_layout(header_line, user_id=None):
+    signature = header_signature(header_line)
+    key = (user_id, signature)
+    with header_layout_cache_lock:
+        cached = header_layout_cache.get(key)
+        if cached and cached[0] > time.time():
+            header_layout_cache.move_to_end(key)
+            return cached[1]
+
+    rows = HeaderLayout.query.filter(
+        HeaderLayout.signature == signature,
+        db.or_(HeaderLayout.user_id == user_id, HeaderLayout.user_id.is_(None)),
+    ).all()
+    row = next((r for r in rows if r.user_id is not None), rows[0] if rows else None)
+    layout = layout_from_row(row) if row else None
+
+    with header_layout_cache_lock:
+        header_layout_cache[key] = (time.time() + HEADER_LAYOUT_CACHE_TTL, layout)
+        header_layout_cache.move_to_end(key)
+        while len(header_layout_cache) > HEADER_LAYOUT_CACHE_SIZE:
+            header_layout_cache.popitem(last=False)
+    return layout
+
+def forget_header_layout(signature):
+    with header_layout_cache_lock:
+        for key in [k for k in header_layout_cache if k[1] == signature]:
+            del header_layout_cache[key]
+
+# store what detection worked out so the next file with this header skips it.
+# the row goes in with the upload's own commit, nothing is committed mid-parse.
+# two first uploads of a new header can both add a shared row (NULLs don't
+# clash in the unique constraint), they hold the same columns so that's harmless
+def remember_header_layout(aggregator):
+    if aggregator.layout is not None or not aggregator.header_line or aggregator.headers is None:
+        return
+    if not aggregator.header_line.strip():
+        return
+
+    signature = header_signature(aggregator.header_line)
+    if not HeaderLayout.query.filter_by(signature=signature, user_id=None).first():
+        db.session.add(HeaderLayout(
+            signature=signature,
+            header=aggregator.header_line.lstrip('\ufeff').strip(),
+            delimiter=aggregator.delimiter,
+            date_col=aggregator._date_idx,
+            item_col=aggregator._item_idx,
+            amount_col=aggregator._amount_idx,
+        ))
+    forget_header_layout(signature)
     
+# batch uploads
+# runs in a worker process, the member is streamed straight out of the zip.
+# settings come in as arguments, the worker has its own copy of app.config
+def aggregate_batch_member(path, member, mode, from_date, to_date, vectorize_rows, exact_cents):
+    aggregator = SalesAggregator(mode=mode, from_date=from_date, to_date=to_date,
+                                 vectorize_rows=vectorize_rows, exact_cents=exact_cents)
+    try:
+        if member is None and path.lower().endswith('.xlsx'):
+            with open(path, 'rb') as stream:
+                feed_workbook(aggregator, stream)
+        elif member is None:
+            with open(path, 'rb') as stream:
+                feed_stream(aggregator, stream, compression=upload_compression(path))
+        else:
+            with zipfile.ZipFile(path) as archive, archive.open(member) as stream:
+                feed_stream(aggregator, stream)
+    except Exception as e:
+        return {'error': str(e)}
+    return {'sales': dict(aggregator.sales), 'skipped_rows': aggregator.skipped_rows,
+            'extra_cols': aggregator.extra_cols}
+
+# list the csv files to parse, zips are expanded to their csv members.
+# zip sizes are the ones in its directory, reading a member stops there
+def batch_members(sources):
+    jobs = []
+    for label, path in sources:
+        if label.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                infos = archive.infolist()
+                if len(infos) > MAX_ZIP_MEMBERS:
+                    raise ValueError(f"{label} has too many entries, the limit is {MAX_ZIP_MEMBERS}")
+                members = [info for info in infos if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+                           and info.filename.lower().endswith('.csv')]
+                if sum(info.file_size for info in members) > app.config['MAX_ZIP_UNCOMPRESSED_BYTES']:
+                    raise ValueError(f"{label} is too large once uncompressed")
+                for info in members:
+                    jobs.append((os.path.basename(info.filename), path, info.filename))
+        else:
+            jobs.append((label, path, None))
+
+    if not jobs:
+        raise ValueError("No .csv files found in the upload")
+    if len(jobs) > MAX_BATCH_FILES:
+        raise ValueError(f"Too many files, the limit is {MAX_BATCH_FILES} per upload")
+    return jobs
+
+# parse every file in parallel and merge into one summary
+def load_sales_batch(sources, mode="date", from_date=None, to_date=None):
+    jobs = batch_members(sources)
+    args = [(path, member, mode, from_date, to_date, app.config['VECTORIZE_MIN_ROWS'], app.config['EXACT_CENTS'])
+            for _, path, member in jobs]
+
+    if len(jobs) == 1:
+        results = [aggregate_batch_member(*args[0])]
+    else:
+        results = list(batch_pool.map(aggregate_batch_member, *zip(*args)))
+
+    sales = defaultdict(float)
+    for (label, _, _), result in zip(jobs, results):
+        if 'error' in result:
+            flash(f"{label}: {result['error']}")
+            continue
+        if result['extra_cols']:
+            flash(f"{label}: ignoring extra columns: {', '.join(result['extra_cols'])}")
+        if result['skipped_rows']:
+            flash(f"{label}: skipped {result['skipped_rows']} invalid rows")
+        for key, amount in result['sales'].items():
+            sales[key] += amount
+
+    if not any('error' not in result for result in results):
+        raise ValueError("None of the files could be processed")
+    return sort_summary(sales, mode)
+
 # generate excel report
 def generate_excel_report(summary, mode="date"):
     wb = Workbook()
@@ -495,6 +1989,7 @@ def generate_excel_report(summary, mode="date"):
         cell.alignment = Alignment(horizontal="center")
 
     # data rows
+    row_index = 1
     for key, total in summary.items():
         if mode == "date":
             row = [key.strftime("%d/%m/%Y"), total]
@@ -504,13 +1999,15 @@ def generate_excel_report(summary, mode="date"):
             row = [key, total]
 
         ws.append(row)
-        # format amount as currency
-        ws.cell(row=ws.max_row, column=len(row)).number_format = numbers.FORMAT_CURRENCY_USD_SIMPLE
-        ws.cell(row=ws.max_row, column=len(row)).alignment = Alignment(horizontal="center")
+        row_index += 1
+        # format amount as currency (ws.max_row rescans every cell, so count rows ourselves)
+        amount_cell = ws.cell(row=row_index, column=len(row))
+        amount_cell.number_format = numbers.FORMAT_CURRENCY_USD_SIMPLE
+        amount_cell.alignment = Alignment(horizontal="center")
 
     # total row
     total_sales = sum(summary.values())
-    total_row_index = ws.max_row + 1
+    total_row_index = row_index + 1
 
     if mode == "combined":
         ws.append(["", "Total", total_sales])
@@ -539,6 +2036,292 @@ def generate_excel_report(summary, mode="date"):
     output.seek(0)
     return output
 
+# free plan only gets 5 uploads. the cached user row can be stale (other
+# workers, a downgrade), so this reads the row fresh and store_upload counts
+# the upload with a conditional update that won't go past the limit
+FREE_UPLOAD_LIMIT = 5
+UPLOAD_LIMIT_MESSAGE = "Free plan limit reached. Upgrade to premium to upload more files."
+
+class UploadLimitReached(Exception):
+    pass
+
+def upload_limit_reached():
+    row = db.session.query(User.plan, User.upload_count).filter_by(id=current_user.id).first()
+    if row is None:
+        return True
+    return row.plan == 'free' and row.upload_count >= FREE_UPLOAD_LIMIT
+
+# save the upload row + its aggregate, raw_files are kept copies of the source
+def store_upload(user_id, filename, summary, mode, raw_files=()):
+    counted = User.query.filter(
+        User.id == user_id,
+        db.or_(User.plan != 'free', User.upload_count < FREE_UPLOAD_LIMIT),
+    ).update({User.upload_count: User.upload_count + 1}, synchronize_session=False)
+    if not counted:
+        db.session.rollback()
+        forget_user(user_id)
+        raise UploadLimitReached(UPLOAD_LIMIT_MESSAGE)
+
+    serialized = serialize_summary(summary, mode)
+    new_upload = Upload(filename=filename, mode=mode, total=sum(summary.values()), user_id=user_id)
+    db.session.add(new_upload)
+    db.session.flush()
+    db.session.add(FileSummary(file_id=new_upload.id, summary_text=json.dumps(serialized)))
+    attach_raw_files(new_upload, raw_files)
+    bump_admin_stats(day=datetime.utcnow().date(), uploads=1, sales_total=new_upload.total)
+    db.session.commit()
+    forget_user(user_id)
+    return new_upload, serialized
+
+# save the upload and make it the current summary
+def record_upload(filename, summary, mode, raw_files=()):
+    new_upload, serialized = store_upload(current_user.id, filename, summary, mode, raw_files)
+    set_current_summary(serialized, mode)
+    return new_upload
+
+def latest_file_summary(upload):
+    return FileSummary.query.filter_by(file_id=upload.id).order_by(FileSummary.generated_at.desc()).first()
+
+# stored aggregate for an upload, None for uploads made before we kept them
+def stored_summary(upload):
+    file_summary = latest_file_summary(upload)
+    if not file_summary or not file_summary.summary_text:
+        return None
+    return load_summary(summary_digest(file_summary.summary_text, upload.mode), upload.mode,
+                        lambda: json.loads(file_summary.summary_text))
+
+# add a delta on top of an existing aggregate, optionally dropping
+# the dates the delta covers first so re-sent days aren't counted twice
+def merge_summaries(base, delta, mode, replace_dates=False):
+    merged = defaultdict(float)
+    for key, amount in base.items():
+        merged[key] += amount
+
+    if replace_dates and mode in ("date", "combined"):
+        if mode == "date":
+            new_dates = set(delta)
+            stale = [key for key in merged if key in new_dates]
+        else:
+            new_dates = {key[0] for key in delta}
+            stale = [key for key in merged if key[0] in new_dates]
+        for key in stale:
+            del merged[key]
+
+    for key, amount in delta.items():
+        merged[key] += amount
+    return sort_summary(merged, mode)
+
+# check the upload we're appending to, returns (upload, error)
+def resolve_append_target(upload_id, replace_dates):
+    upload = Upload.query.filter_by(id=upload_id, user_id=current_user.id).first()
+    if not upload or latest_file_summary(upload) is None:
+        return None, "That upload has no stored summary to append to."
+    if replace_dates and upload.mode == "item":
+        return None, "Replacing overlapping dates needs a summary by date or date + item."
+    return upload, None
+
+def append_to_upload(upload, delta, replace_dates=False, raw_files=()):
+    merged = merge_summaries(stored_summary(upload), delta, upload.mode, replace_dates)
+    serialized = serialize_summary(merged, upload.mode)
+
+    file_summary = latest_file_summary(upload)
+    file_summary.summary_text = json.dumps(serialized)
+    file_summary.generated_at = datetime.utcnow()
+    previous_total = upload.total or 0.0
+    upload.total = sum(merged.values())
+    bump_admin_stats(day=upload.uploaded_at.date() if upload.uploaded_at else None,
+                     sales_total=upload.total - previous_total)
+    attach_raw_files(upload, raw_files)
+    db.session.commit()
+
+    set_current_summary(serialized, upload.mode)
+    return merged
+
+# cross-upload history
+# every stored aggregate is already sorted by date, so a user's history is
+# a k-way merge of them into per-day and per-item runs with prefix sums on
+# top, a date range total is then two bisects. only the summary store is
+# read, never the raw files
+HISTORY_CACHE_SIZE = 64
+HISTORY_GROUPS = ("date", "item")
+EMPTY_RUN = (array('i'), array('d'), array('d', [0.0]))
+history_indexes = OrderedDict()
+history_lock = threading.Lock()
+
+# merge date sorted (day, amount) runs into days, daily totals and prefix sums
+def merge_day_runs(runs):
+    days, amounts, prefix = array('i'), array('d'), array('d', [0.0])
+    for day, amount in heapq.merge(*runs):
+        if days and days[-1] == day:
+            amounts[-1] += amount
+            prefix[-1] += amount
+        else:
+            days.append(day)
+            amounts.append(amount)
+            prefix.append(prefix[-1] + amount)
+    return days, amounts, prefix
+
+def day_range(days, from_date=None, to_date=None):
+    start = bisect.bisect_left(days, from_date.toordinal()) if from_date else 0
+    end = bisect.bisect_right(days, to_date.toordinal()) if to_date else len(days)
+    return start, end
+
+class SalesHistory:
+    def __init__(self, summaries):
+        self.mode_counts = defaultdict(int)
+        for summary in summaries:
+            self.mode_counts[summary.mode] += 1
+
+        # date and date + item uploads both have daily totals
+        self.days, self.day_amounts, self.day_prefix = merge_day_runs(
+            zip(summary.days, summary.amounts) for summary in summaries if summary.mode != "item"
+        )
+
+        # per item runs only come from date + item uploads
+        runs = defaultdict(list)
+        for summary in summaries:
+            if summary.mode != "combined":
+                continue
+            per_item = defaultdict(list)
+            names = summary.item_names
+            for day, code, amount in zip(summary.days, summary.codes, summary.amounts):
+                per_item[names[code]].append((day, amount))
+            for name, run in per_item.items():
+                runs[name].append(run)
+        self.items = {name: merge_day_runs(item_runs) for name, item_runs in runs.items()}
+
+        # item only uploads have no dates, they only count when no range is asked for
+        self.undated = defaultdict(float)
+        for summary in summaries:
+            if summary.mode == "item":
+                for name, amount in summary.items():
+                    self.undated[name] += amount
+
+        self.item_names = sorted(set(self.items) | set(self.undated), key=str.lower)
+
+    # daily totals, for one item if given
+    def by_date(self, from_date=None, to_date=None, item=None):
+        if item:
+            days, amounts, _ = self.items.get(item, EMPTY_RUN)
+        else:
+            days, amounts = self.days, self.day_amounts
+        start, end = day_range(days, from_date, to_date)
+        return ColumnarSummary("date", days[start:end], None, amounts[start:end])
+
+    # None when the item has no sales in the range
+    def item_total(self, item, from_date=None, to_date=None):
+        days, _, prefix = self.items.get(item, EMPTY_RUN)
+        start, end = day_range(days, from_date, to_date)
+        undated = item in self.undated and not from_date and not to_date
+        if start == end and not undated:
+            return None
+        return prefix[end] - prefix[start] + (self.undated[item] if undated else 0.0)
+
+    def by_item(self, from_date=None, to_date=None, item=None):
+        summary = ColumnarSummary("item")
+        for name in ([item] if item else self.item_names):
+            total = self.item_total(name, from_date, to_date)
+            if total is not None:
+                summary.append(name, total)
+        return summary
+
+    def query(self, group, from_date=None, to_date=None, item=None):
+        if group == "item":
+            return self.by_item(from_date, to_date, item)
+        return self.by_date(from_date, to_date, item)
+
+# the history for a user, rebuilt only when one of their stored aggregates changed
+def history_for(user_id):
+    rows = (db.session.query(FileSummary.id, FileSummary.file_id, FileSummary.generated_at, Upload.mode)
+            .join(Upload, Upload.id == FileSummary.file_id)
+            .filter(Upload.user_id == user_id, FileSummary.summary_text.isnot(None))
+            .order_by(FileSummary.file_id, FileSummary.generated_at)
+            .all())
+    # last row per upload is its latest summary, same as latest_file_summary
+    latest = {file_id: (summary_id, generated_at, mode) for summary_id, file_id, generated_at, mode in rows}
+    version = hashlib.sha256(repr(sorted(latest.items())).encode('utf-8')).hexdigest()
+
+    with history_lock:
+        cached = history_indexes.get(user_id)
+        if cached and cached[0] == version:
+            history_indexes.move_to_end(user_id)
+            return cached
+
+    modes = {summary_id: mode for summary_id, _, mode in latest.values()}
+    texts = db.session.query(FileSummary.id, FileSummary.summary_text).filter(FileSummary.id.in_(list(modes)))
+    summaries = [
+        load_summary(summary_digest(text, modes[summary_id]), modes[summary_id], lambda text=text: json.loads(text))
+        for summary_id, text in texts
+    ]
+    entry = (version, SalesHistory(summaries))
+
+    with history_lock:
+        history_indexes[user_id] = entry
+        history_indexes.move_to_end(user_id)
+        while len(history_indexes) > HISTORY_CACHE_SIZE:
+            history_indexes.popitem(last=False)
+    return entry
+
+# chart/table labels for a summary
+def summary_labels(summary, mode):
+    labels = []
+    data = []
+    for key, total in summary.items():
+        if mode == "date":
+            labels.append(key.strftime("%d/%m/%Y"))
+        elif mode == "combined":
+            labels.append(f"{key[0].strftime('%d/%m/%Y')} - {key[1]}")
+        else:
+            labels.append(str(key))
+        data.append(total)
+    return labels, data
+
+# generate pdf report, needs an app context for the template
+def generate_pdf_report(summary, mode, chart_type="bar", chart_image=None, base_url=None):
+    labels, data = summary_labels(summary, mode)
+    summary_date = f"{labels[0]} to {labels[-1]}" if labels else "All data"
+    summary_rows = list(zip(labels, data))
+
+    rendered_HTML = render_template(
+        "dashboard_pdf.html",
+        labels=labels,
+        data=data,
+        mode=mode,
+        chart_type=chart_type,
+        summary_date=summary_date,
+        summary_rows=summary_rows,
+        chart_image=chart_image
+    )
+    return HTML(string=rendered_HTML, base_url=base_url).write_pdf()
+
+# generate csv report
+def generate_csv_report(summary, mode="date"):
+    output = StringIO()
+    writer = csv.writer(output)
+
+    if mode == "date":
+        writer.writerow(["Date", "Total Sales ($)"])
+    elif mode == "combined":
+        writer.writerow(["Date", "Item", "Total Sales ($)"])
+    else:
+        writer.writerow(["Item", "Total Sales ($)"])
+
+    for key, total in summary.items():
+        if mode == "date":
+            writer.writerow([key.strftime("%d/%m/%Y"), f"{total:.2f}"])
+        elif mode == "combined":
+            writer.writerow([key[0].strftime("%d/%m/%Y"), key[1], f"{total:.2f}"])
+        else:
+            writer.writerow([key, f"{total:.2f}"])
+
+    total_sales = sum(summary.values())
+    if mode == "combined":
+        writer.writerow(["", "Total", f"{total_sales:.2f}"])
+    else:
+        writer.writerow(["Total", f"{total_sales:.2f}"])
+
+    return BytesIO(output.getvalue().encode('utf-8'))
+
 # to index page
 @app.route("/index", methods=["GET", "POST"])
 @login_required
@@ -547,11 +2330,10 @@ def index():
     mode = "date"
 
     # check if user has a pending upgrade request
-    pending_request = PaymentRequest.query.filter_by(user_id=current_user.id, status='pending').first()
+    pending_request = has_pending_request(current_user.id)
 
     if request.method == "GET" and request.args.get("clear"):
-        session.pop('latest_summary', None)
-        session.pop('latest_mode', None)
+        clear_current_summary()
         flash("Summary cleared.")
         return redirect(url_for("index"))
 
@@ -566,78 +2348,876 @@ def index():
         return redirect(url_for("index"))
 
     if request.method == "POST":
-        file = request.files.get('file')
+        files = [f for f in request.files.getlist('file') if f and f.filename]
         mode = request.form.get('mode', 'date')
+        append_to = request.form.get('append_to', type=int)
+        replace_dates = bool(request.form.get('replace_dates'))
 
-        if not file or not file.filename.lower().endswith('.csv'):
-            flash("Only .CSV files are supported.", "warning")
+        if not files or not all(f.filename.lower().endswith(CSV_SUFFIXES + ('.xlsx', '.zip')) for f in files):
+            flash("Only .CSV files (optionally .gz, .bz2 or .xz compressed), .XLSX or .ZIP files are supported.", "warning")
             return redirect(url_for("index"))
 
-        if current_user.plan == 'free':
-            upload_count = Upload.query.filter_by(user_id=current_user.id).count()
-            if upload_count >= 5:
-                flash("Free plan limit reached. Upgrade to premium to upload more files.")
-                return redirect(url_for('upgrade_manual'))
+        # append mode merges into an earlier upload instead of making a new one
+        target = None
+        if append_to:
+            target, error = resolve_append_target(append_to, replace_dates)
+            if error:
+                flash(error, "warning")
+                return redirect(url_for("index"))
+            mode = target.mode
+        elif upload_limit_reached():
+            flash(UPLOAD_LIMIT_MESSAGE)
+            return redirect(url_for('upgrade_manual'))
 
-        filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # several files or a zip are merged into one summary
+        is_batch = len(files) > 1 or files[0].filename.lower().endswith('.zip')
+        keep_raw = app.config['KEEP_RAW_UPLOADS']
+        saved = []
+        progress = ingest_progress(request.form.get('progress_id'), None if is_batch else upload_size(files[0]))
 
         try:
-            with open(filepath, 'rb') as f:
-                summary = load_sales_data(f, mode=mode, from_date=from_date, to_date=to_date)
+            if is_batch:
+                # the workers read the files from disk
+                for file in files:
+                    saved_name = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], saved_name))
+                    saved.append((file.filename, saved_name))
+                filename = saved[0][1] if len(saved) == 1 else f"{saved[0][1]}_and_{len(saved) - 1}_more"
+
+                sources = [(label, os.path.join(app.config['UPLOAD_FOLDER'], name)) for label, name in saved]
+                progress.stage('parsing')
+                summary = load_sales_batch(sources, mode=mode, from_date=from_date, to_date=to_date)
+            else:
+                # parse the upload where it is, only write it out if it's being kept
+                filename = f"{uuid.uuid4().hex}_{secure_filename(files[0].filename)}"
+                compression = upload_compression(filename)
+                if filename.lower().endswith('.xlsx'):
+                    # workbooks are zips, openpyxl needs to seek around in them
+                    if keep_raw:
+                        saved.append((files[0].filename, filename))
+                        files[0].save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                    summary = load_sales_workbook(files[0].stream, mode=mode, from_date=from_date, to_date=to_date,
+                                                  progress=progress)
+                elif preview_wanted(progress.total, target):
+                    # big file, preview now and finish it in the background. the job
+                    # gets its own handle on the form's temp file, the request closes this one
+                    source = os.fdopen(os.dup(files[0].stream.fileno()), 'rb')
+                    start_summary_job(source, filename, progress.total, mode, from_date, to_date, progress)
+                    return redirect(url_for("index"))
+                elif keep_raw:
+                    saved.append((files[0].filename, filename))
+                    with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'wb') as tee:
+                        summary = load_sales_data(files[0].stream, mode=mode, from_date=from_date,
+                                                  to_date=to_date, tee=tee, compression=compression,
+                                                  progress=progress)
+                else:
+                    summary = load_sales_data(files[0].stream, mode=mode, from_date=from_date,
+                                              to_date=to_date, compression=compression, progress=progress)
 
             if not summary:
+                progress.stage('done')
                 flash("No sales data found for the selected data range", "warning")
                 return redirect(url_for("index"))
 
-            new_upload = Upload(filename=filename, mode=mode, total=sum(summary.values()), user_id=current_user.id)
-            db.session.add(new_upload)
-            db.session.commit()
+            raw_files = [os.path.join(app.config['UPLOAD_FOLDER'], name) for _, name in saved] if keep_raw else []
+            if target:
+                summary = append_to_upload(target, summary, replace_dates, raw_files)
+                flash(f"Appended to {target.filename}.", "success")
+            else:
+                record_upload(filename, summary, mode, raw_files)
+            progress.stage('done')
 
-            session['latest_summary'] = serialize_summary(summary, mode)
-            session['latest_mode'] = mode
+        except UploadLimitReached as e:
+            progress.stage('error', message=str(e))
+            flash(str(e))
+            return redirect(url_for('upgrade_manual'))
 
         except Exception as e:
+            progress.stage('error', message=str(e))
             flash(f"Error processing file: {e}")
             return redirect(url_for("index"))
 
         finally:
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            # anything kept has been moved into the blob store by now
+            for _, name in saved:
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                if os.path.exists(filepath):
+                    os.remove(filepath)
 
     if summary is None:
-        serialized = session.get('latest_summary')
-        mode = session.get('latest_mode', 'date')
-        if serialized:
-            summary = deserialize_summary(serialized, mode)
+        summary, mode = get_current_summary()
 
     total_sales = sum(summary.values()) if summary else 0
 
+    # earlier uploads a new file can be appended to
+    append_targets = (
+        Upload.query.join(FileSummary, FileSummary.file_id == Upload.id)
+        .filter(Upload.user_id == current_user.id)
+        .order_by(Upload.uploaded_at.desc())
+        .limit(20)
+        .all()
+    )
+
     # pass pending_request to the template
     return render_template(
         "index.html",
         summary=summary,
         mode=mode,
         total_sales=total_sales,
-        pending_request=pending_request
+        pending_request=pending_request,
+        append_targets=append_targets,
+        chunked_upload_threshold=CHUNKED_UPLOAD_THRESHOLD
     )
 
 
+# upload previews
+# files over PREVIEW_MIN_BYTES get a summary of their first PREVIEW_BYTES
+# straight away, flagged partial with the total scaled up by how much of the
+# file it covered. the full pass runs in summary_job_pool and is recorded as
+# a normal upload, the next request after it's done swaps it in
+app.config['PREVIEW_MIN_BYTES'] = int(os.getenv('PREVIEW_MIN_BYTES', 64 * 1024 * 1024))
+PREVIEW_BYTES = 4 * 1024 * 1024
+SUMMARY_JOB_MAX_AGE = 60 * 60
+summary_job_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summary-job')
+
+# appends always run in full, they have nothing to preview against
+def preview_wanted(size, append_to):
+    return not append_to and size >= app.config['PREVIEW_MIN_BYTES']
+
+def upload_size(file):
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size
+
+# returns (summary, fraction of the file it covers). only whole lines are
+# parsed, so the fraction counts the bytes behind those and not the cut off
+# tail (for compressed files the parsed share of what was decompressed)
+def preview_summary(source, size, mode, from_date, to_date, compression=None):
+    aggregator = new_aggregator(mode, from_date, to_date)
+    raw = SourceReader(source)
+    stream = COMPRESSED_UPLOADS[compression](raw) if compression else raw
+    tail = b''
+    read = parsed = 0
+    for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b''):
+        # whole lines only, a cut off amount would be wrong not just missing
+        read += len(chunk)
+        data = tail + chunk
+        cut = data.rfind(b'\n') + 1
+        aggregator.feed(data[:cut])
+        parsed += cut
+        tail = data[cut:]
+        if raw.bytes_read >= PREVIEW_BYTES:
+            break
+    else:
+        aggregator.feed(tail)
+        parsed += len(tail)
+    consumed = raw.bytes_read * parsed / read if read else 0
+    aggregator.close()
+    return aggregator.result(), min(consumed / max(size, 1), 1.0)
+
+# source is an open file the job takes over. path is where it already sits on
+# disk (an assembled chunked upload), None for a form upload's temp file which
+# is then only written out if it's being kept
+def start_summary_job(source, filename, size, mode, from_date, to_date, progress, path=None):
+    compression = upload_compression(filename)
+    try:
+        source.seek(0)
+        preview, fraction = preview_summary(source, size, mode, from_date, to_date, compression)
+        source.seek(0)
+    except Exception:
+        source.close()
+        if path is not None:
+            os.remove(path)
+        raise
+
+    prune_summary_jobs()
+    summary_job_pool.submit(run_summary_job, source, path, filename, new_aggregator(mode, from_date, to_date),
+                            current_user.id, compression, app.config['KEEP_RAW_UPLOADS'], progress)
+
+    set_current_summary(serialize_summary(preview, mode), mode)
+    preview_total = sum(preview.values())
+    session['summary_job'] = {
+        'filename': filename,
+        'fraction': fraction,
+        'estimated_total': preview_total / fraction if fraction else preview_total,
+        'started': int(time.time()),
+        # the page listens on this to reload once the full summary is in
+        'progress_id': progress.key[1] if progress.key else None,
+    }
+    flash(f"Showing a preview from the first {fraction:.0%} of the file, the full summary is being built.")
+
+# runs in summary_job_pool
+def run_summary_job(source, path, filename, aggregator, user_id, compression, keep_raw, progress):
+    error = None
+    tee = None
+    with app.app_context():
+        try:
+            if keep_raw and path is None:
+                path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                tee = open(path, 'wb')
+            feed_stream(aggregator, source, tee, compression, progress)
+            if tee is not None:
+                tee.close()
+            progress.stage('saving', aggregator)
+            remember_header_layout(aggregator)
+            summary = aggregator.result()
+            if summary:
+                store_upload(user_id, filename, summary, aggregator.mode, [path] if keep_raw else ())
+            else:
+                error = "No sales data found for the selected data range"
+        except UploadLimitReached as e:
+            error = str(e)
+        except Exception as e:
+            db.session.rollback()
+            error = f"Error processing file: {e}"
+        finally:
+            source.close()
+            if tee is not None:
+                tee.close()
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    save_summary_job_outcome(filename, {'error': error, 'skipped_rows': aggregator.skipped_rows})
+    if error:
+        progress.stage('error', aggregator, message=error)
+    else:
+        progress.stage('done', aggregator)
+
+def summary_job_path(filename):
+    return os.path.join(SUMMARY_JOB_FOLDER, f"{filename}.json")
+
+def save_summary_job_outcome(filename, outcome):
+    path = summary_job_path(filename)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(outcome, f)
+    os.replace(tmp_path, path)
+
+# the outcome is read once, by the request that shows it
+def pop_summary_job_outcome(filename):
+    path = summary_job_path(filename)
+    try:
+        with open(path) as f:
+            outcome = json.load(f)
+        os.remove(path)
+    except (FileNotFoundError, ValueError):
+        return None
+    return outcome
+
+# outcomes nobody came back for
+def prune_summary_jobs():
+    cutoff = time.time() - SUMMARY_JOB_MAX_AGE
+    for entry in os.scandir(SUMMARY_JOB_FOLDER):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+# swap the preview for the full summary once the job has recorded it.
+# the outcome file and the upload row are both shared, so it works whichever
+# process ran the job
+@app.before_request
+def collect_summary_job():
+    job = session.get('summary_job')
+    if not job or request.endpoint in ('static', 'progress_events') or not current_user.is_authenticated:
+        return
+
+    outcome = pop_summary_job_outcome(job['filename'])
+    if outcome and outcome['error']:
+        clear_current_summary()
+        flash(outcome['error'])
+        return
+
+    upload = Upload.query.filter_by(user_id=current_user.id, filename=job['filename']).first()
+    if upload:
+        set_current_summary(json.loads(latest_file_summary(upload).summary_text), upload.mode)
+        if outcome and outcome['skipped_rows']:
+            flash(f"Skipped {outcome['skipped_rows']} invalid rows during import")
+        flash("The full summary is ready.")
+    elif time.time() - job['started'] > SUMMARY_JOB_MAX_AGE:
+        session.pop('summary_job', None)
+        flash("The full summary for your last upload didn't finish, please upload it again.")
+
+
+# chunked uploads
+# big files are sent in fixed size parts, each part is appended to a .part file
+# and fed to the aggregator straight away so parsing overlaps the upload.
+# a dropped connection resumes from the offset the server reports
+def chunk_paths(upload_id):
+    base = os.path.join(CHUNK_FOLDER, upload_id)
+    return base + '.part', base + '.json'
+
+def save_chunk_meta(entry):
+    meta = {k: v for k, v in entry.items() if k not in ('aggregator', 'lock', 'updated')}
+    with open(chunk_paths(entry['upload_id'])[1], 'w') as f:
+        json.dump(meta, f)
+
+def remove_chunked_upload(upload_id):
+    with chunked_uploads_lock:
+        chunked_uploads.pop(upload_id, None)
+    for path in chunk_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+
+# drop uploads nobody came back for, along with their in-memory entry
+# (and the aggregator it's holding on to)
+def cleanup_stale_chunks():
+    cutoff = time.time() - CHUNKED_UPLOAD_MAX_AGE
+    with chunked_uploads_lock:
+        for upload_id in [k for k, entry in chunked_uploads.items() if entry['updated'] < cutoff]:
+            del chunked_uploads[upload_id]
+    for name in os.listdir(CHUNK_FOLDER):
+        path = os.path.join(CHUNK_FOLDER, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            continue
+
+def get_chunked_upload(upload_id):
+    with chunked_uploads_lock:
+        entry = chunked_uploads.get(upload_id)
+        if entry is None:
+            # server restarted mid upload, the bytes on disk are still good
+            part_path, meta_path = chunk_paths(secure_filename(upload_id))
+            if not os.path.exists(meta_path):
+                return None
+            with open(meta_path) as f:
+                entry = json.load(f)
+            entry['received'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            entry['updated'] = time.time()
+            entry['aggregator'] = None
+            entry['lock'] = threading.Lock()
+            chunked_uploads[upload_id] = entry
+
+    if entry['user_id'] != current_user.id:
+        return None
+    return entry
+
+def chunk_error(message, status=400):
+    flash(message)
+    return jsonify(error=message, redirect=url_for("index")), status
+
+# checks the options a chunked or streamed upload starts with,
+# returns (options, error response)
+def upload_options(info):
+    original_name = info.get('filename') or ''
+    mode = info.get('mode') or 'date'
+
+    if not original_name.lower().endswith(CSV_SUFFIXES):
+        return None, chunk_error("Only .CSV files (optionally .gz, .bz2 or .xz compressed) are supported.")
+    if mode not in ('date', 'item', 'combined'):
+        return None, chunk_error("Unknown summary mode.")
+
+    append_to = info.get('append_to')
+    replace_dates = bool(info.get('replace_dates'))
+    if append_to:
+        try:
+            target, error = resolve_append_target(int(append_to), replace_dates)
+        except ValueError:
+            target, error = None, "That upload has no stored summary to append to."
+        if error:
+            return None, chunk_error(error)
+        append_to, mode = target.id, target.mode
+    elif upload_limit_reached():
+        flash(UPLOAD_LIMIT_MESSAGE)
+        return None, (jsonify(error="limit", redirect=url_for('upgrade_manual')), 403)
+
+    try:
+        from_date = parse_date_flexible(info['from_date']) if info.get('from_date') else None
+        to_date = parse_date_flexible(info['to_date']) if info.get('to_date') else None
+    except ValueError as e:
+        return None, chunk_error(str(e))
+
+    return {
+        'original_name': original_name,
+        'mode': mode,
+        'from_date': from_date,
+        'to_date': to_date,
+        'append_to': append_to or None,
+        'replace_dates': replace_dates,
+        'progress_id': info.get('progress_id'),
+    }, None
+
+# record the summary (or append it) once a chunked/streamed upload is parsed
+def save_uploaded_summary(summary, filename, options, progress, raw_files=()):
+    if not summary:
+        for path in raw_files:
+            os.remove(path)
+        progress.stage('done')
+        flash("No sales data found for the selected data range", "warning")
+        return jsonify(done=True, redirect=url_for("index"))
+
+    target = Upload.query.filter_by(id=options['append_to'], user_id=current_user.id).first() if options['append_to'] else None
+    if target:
+        append_to_upload(target, summary, options['replace_dates'], raw_files)
+    else:
+        try:
+            record_upload(filename, summary, options['mode'], raw_files)
+        except UploadLimitReached as e:
+            for path in raw_files:
+                os.remove(path)
+            progress.stage('error', message=str(e))
+            flash(str(e))
+            return jsonify(error="limit", redirect=url_for('upgrade_manual')), 403
+    progress.stage('done')
+    return jsonify(done=True, redirect=url_for("index"))
+
+@app.route("/upload/chunked", methods=["POST"])
+@login_required
+def start_chunked_upload():
+    info = request.get_json(silent=True) or {}
+    size = info.get('size')
+    if not isinstance(size, int) or size <= 0:
+        return chunk_error("Upload size is missing.")
+
+    options, error = upload_options(info)
+    if error:
+        return error
+    from_date, to_date = options['from_date'], options['to_date']
+
+    cleanup_stale_chunks()
+
+    upload_id = uuid.uuid4().hex
+    entry = {
+        'upload_id': upload_id,
+        'user_id': current_user.id,
+        'filename': f"{upload_id}_{secure_filename(options['original_name'])}",
+        'size': size,
+        'received': 0,
+        'updated': time.time(),
+        'mode': options['mode'],
+        'from_date': from_date.isoformat() if from_date else None,
+        'to_date': to_date.isoformat() if to_date else None,
+        'append_to': options['append_to'],
+        'replace_dates': options['replace_dates'],
+        'progress_id': options['progress_id'],
+        # compressed files are parsed from the assembled file at the end,
+        # big ones get a preview once they're in and finish in the background
+        'aggregator': (None if upload_compression(options['original_name']) or preview_wanted(size, options['append_to'])
+                       else new_aggregator(options['mode'], from_date, to_date)),
+        'lock': threading.Lock(),
+    }
+    open(chunk_paths(upload_id)[0], 'wb').close()
+    save_chunk_meta(entry)
+    with chunked_uploads_lock:
+        chunked_uploads[upload_id] = entry
+
+    return jsonify(upload_id=upload_id, chunk_size=CHUNK_SIZE, offset=0)
+
+@app.route("/upload/chunked/<upload_id>", methods=["GET"])
+@login_required
+def chunked_upload_status(upload_id):
+    entry = get_chunked_upload(upload_id)
+    if entry is None:
+        abort(404)
+    return jsonify(offset=entry['received'], size=entry['size'])
+
+@app.route("/upload/chunked/<upload_id>", methods=["PUT"])
+@login_required
+def upload_chunk(upload_id):
+    entry = get_chunked_upload(upload_id)
+    if entry is None:
+        abort(404)
+
+    with entry['lock']:
+        offset = request.args.get('offset', type=int)
+        if offset != entry['received']:
+            # client is out of sync, tell it where to carry on from
+            return jsonify(offset=entry['received']), 409
+
+        chunk = request.get_data(cache=False)
+        if not chunk or len(chunk) > CHUNK_SIZE or offset + len(chunk) > entry['size']:
+            return jsonify(error="Invalid chunk size", offset=entry['received']), 400
+
+        checksum = request.headers.get('X-Chunk-Sha256')
+        if checksum and hashlib.sha256(chunk).hexdigest() != checksum.lower():
+            return jsonify(error="Checksum mismatch", offset=entry['received']), 400
+
+        part_path = chunk_paths(upload_id)[0]
+        with open(part_path, 'ab') as f:
+            f.truncate(offset)
+            f.write(chunk)
+        entry['received'] = offset + len(chunk)
+        entry['updated'] = time.time()
+        progress = ingest_progress(entry.get('progress_id'), entry['size'])
+
+        try:
+            # only parse along the way if we've seen every byte so far
+            if entry['aggregator'] is not None:
+                entry['aggregator'].feed(chunk)
+
+            if entry['received'] < entry['size']:
+                progress.stage('uploading', entry['aggregator'], entry['received'])
+                return jsonify(offset=entry['received'])
+
+            if preview_wanted(entry['size'], entry['append_to']):
+                raw_path = os.path.join(app.config['UPLOAD_FOLDER'], entry['filename'])
+                os.replace(part_path, raw_path)
+                remove_chunked_upload(upload_id)
+                start_summary_job(open(raw_path, 'rb'), entry['filename'], entry['size'], entry['mode'],
+                                  chunk_date(entry['from_date']), chunk_date(entry['to_date']), progress, raw_path)
+                return jsonify(done=True, redirect=url_for("index"))
+
+            summary = finish_chunked_upload(entry, part_path, progress)
+        except Exception as e:
+            remove_chunked_upload(upload_id)
+            progress.stage('error', message=str(e))
+            return chunk_error(f"Error processing file: {e}")
+
+    raw_files = []
+    if app.config['KEEP_RAW_UPLOADS']:
+        raw_path = os.path.join(app.config['UPLOAD_FOLDER'], entry['filename'])
+        os.replace(part_path, raw_path)
+        raw_files.append(raw_path)
+    remove_chunked_upload(upload_id)
+    return save_uploaded_summary(summary, entry['filename'], entry, progress, raw_files)
+
+# streamed upload
+# the csv is the raw request body and the options are in the query string,
+# so it can be parsed as it arrives without waiting for a multipart form
+@app.route("/upload/stream", methods=["POST"])
+@login_required
+def stream_upload():
+    options, error = upload_options(request.args)
+    if error:
+        return error
+
+    filename = f"{uuid.uuid4().hex}_{secure_filename(options['original_name'])}"
+    raw_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    tee = open(raw_path, 'wb') if app.config['KEEP_RAW_UPLOADS'] else None
+    progress = ingest_progress(options['progress_id'], request.content_length)
+    try:
+        aggregator = new_aggregator(options['mode'], options['from_date'], options['to_date'])
+        feed_stream(aggregator, request.stream, tee, upload_compression(filename), progress)
+        progress.stage('saving', aggregator)
+        remember_header_layout(aggregator)
+        flash_import_notes(aggregator)
+        summary = aggregator.result()
+    except Exception as e:
+        if tee is not None:
+            tee.close()
+            os.remove(raw_path)
+        progress.stage('error', message=str(e))
+        return chunk_error(f"Error processing file: {e}")
+    finally:
+        if tee is not None:
+            tee.close()
+
+    return save_uploaded_summary(summary, filename, options, progress, [raw_path] if tee is not None else ())
+
+# server-sent events for one upload's progress, the browser's EventSource
+# reconnects by itself if the stream is closed before the upload is done
+@app.route("/progress/<progress_id>")
+@login_required
+def progress_events(progress_id):
+    if not PROGRESS_ID.fullmatch(progress_id):
+        abort(404)
+    key = (current_user.id, progress_id)
+
+    def events():
+        version = 0
+        deadline = time.time() + PROGRESS_STREAM_MAX_AGE
+        yield "retry: 1000\n\n"
+        while time.time() < deadline:
+            state, version = wait_for_progress(key, version, PROGRESS_KEEPALIVE)
+            if state is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {json.dumps(state)}\n\n"
+            if state['stage'] in ('done', 'error'):
+                return
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # don't let nginx hold the events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def chunk_date(value):
+    return date.fromisoformat(value) if value else None
+
+def finish_chunked_upload(entry, part_path, progress):
+    aggregator = entry['aggregator']
+    if aggregator is None:
+        with open(part_path, 'rb') as f:
+            return load_sales_data(f, mode=entry['mode'], from_date=chunk_date(entry['from_date']),
+                                   to_date=chunk_date(entry['to_date']),
+                                   compression=upload_compression(entry['filename']), progress=progress)
+
+    aggregator.close()
+    progress.stage('saving', aggregator, entry['received'])
+    remember_header_layout(aggregator)
+    flash_import_notes(aggregator)
+    return aggregator.result()
+
+
+
+# export cache
+# one file per (summary version, mode, chart, locale, format), named by the
+# hash of that key. a hit touches the file so the oldest mtime is the least
+# recently used one when the folder goes over its size cap
+def cached_export(key_parts, build):
+    key = hashlib.sha256("|".join(str(part) for part in key_parts).encode('utf-8')).hexdigest()
+    path = os.path.join(EXPORT_CACHE_FOLDER, key)
+    try:
+        f = open(path, 'rb')
+        os.utime(path)
+        return f
+    except FileNotFoundError:
+        pass
+
+    data = build()
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    prune_cache_folder(EXPORT_CACHE_FOLDER, app.config['EXPORT_CACHE_MAX_BYTES'])
+    return BytesIO(data)
+
+# drop the least recently used files (oldest mtime) until the folder fits,
+# keep is a file that was just written and is about to be read
+def prune_cache_folder(folder, max_bytes, keep=None):
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# blob store
+# kept raw uploads and payment proofs are stored once per content under
+# blobs/<first two hex>/<sha256>, so re-sent files don't pile up as copies.
+# the blob row's refcount follows the upload_file rows / payment requests
+# pointing at it. collect_blobs() (a background thread every
+# BLOB_GC_INTERVAL, or `flask gc-blobs`) drops references past their
+# retention, then deletes unreferenced blobs and stray files
+BLOB_GC_GRACE = 60 * 60
+blob_gc_lock = threading.Lock()
+blob_gc_thread = None
+
+def blob_path(sha256):
+    return os.path.join(BLOB_FOLDER, sha256[:2], sha256)
+
+def blob_tmp_path():
+    return os.path.join(BLOB_FOLDER, f"{uuid.uuid4().hex}.tmp")
+
+# move a finished file into the store, returns (sha256, size)
+def put_blob(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    sha256 = digest.hexdigest()
+
+    target = blob_path(sha256)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        # already stored, touching it keeps the gc off it until the reference is saved
+        os.utime(target)
+        os.remove(path)
+    else:
+        os.replace(path, target)
+    return sha256, size
+
+# one more reference, call before adding the row that points at the blob,
+# in the same transaction
+def retain_blob(sha256, size):
+    changes = {Blob.refcount: Blob.refcount + 1, Blob.updated_at: datetime.utcnow()}
+    if Blob.query.filter_by(sha256=sha256).update(changes, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(sha256=sha256, size=size, refcount=1))
+    except IntegrityError:
+        Blob.query.filter_by(sha256=sha256).update(changes, synchronize_session=False)
+
+def release_blob(sha256):
+    Blob.query.filter_by(sha256=sha256).update(
+        {Blob.refcount: Blob.refcount - 1, Blob.updated_at: datetime.utcnow()}, synchronize_session=False
+    )
+
+# move kept raw files into the store and link them to the upload
+def attach_raw_files(upload, paths):
+    for path in paths:
+        sha256, size = put_blob(path)
+        retain_blob(sha256, size)
+        db.session.add(UploadFile(upload_id=upload.id, blob_sha256=sha256, name=os.path.basename(path)))
+
+# the raw file to rebuild an upload from, None if it wasn't kept
+def upload_raw_file(upload):
+    kept = UploadFile.query.filter_by(upload_id=upload.id).order_by(UploadFile.id).all()
+    if len(kept) == 1 and os.path.exists(blob_path(kept[0].blob_sha256)):
+        return kept[0].name, blob_path(kept[0].blob_sha256)
+    filename = secure_filename(upload.filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    return (filename, filepath) if os.path.exists(filepath) else None
+
+# serve a blob, or hand it to the front server. the content never changes
+# for a hash, so the hash is the etag. blobs are private files (bank
+# receipts), nothing between us and the browser gets to keep a copy
+def send_blob(sha256, download_name, as_attachment=False):
+    path = blob_path(sha256)
+    if not os.path.exists(path):
+        abort(404)
+
+    offload = app.config['BLOB_OFFLOAD']
+    if offload not in ('x-sendfile', 'x-accel-redirect'):
+        # send_file answers Range and conditional requests itself
+        response = send_file(path, download_name=download_name, as_attachment=as_attachment,
+                             etag=sha256, max_age=0, conditional=True)
+    else:
+        response = make_response('')
+        response.headers['Content-Type'] = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', filename=download_name)
+        if offload == 'x-sendfile':
+            response.headers['X-Sendfile'] = path
+        else:
+            response.headers['X-Accel-Redirect'] = f"{app.config['BLOB_ACCEL_PREFIX'].rstrip('/')}/{sha256[:2]}/{sha256}"
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    response.cache_control.max_age = None
+    response.headers.pop('Expires', None)
+    return response
+
+# retention, then delete what nothing points at. returns counts for the log
+def collect_blobs():
+    now = datetime.utcnow()
+    released = 0
+
+    # raw copies past their age
+    cutoff = now - timedelta(days=app.config['RAW_UPLOAD_MAX_AGE_DAYS'])
+    for kept in UploadFile.query.join(Upload, Upload.id == UploadFile.upload_id).filter(Upload.uploaded_at < cutoff).all():
+        release_blob(kept.blob_sha256)
+        db.session.delete(kept)
+        released += 1
+
+    # proofs of requests processed long enough ago, pending ones are always kept
+    cutoff = now - timedelta(days=app.config['PROOF_MAX_AGE_DAYS'])
+    for payment in PaymentRequest.query.filter(PaymentRequest.proof_blob.isnot(None),
+                                               PaymentRequest.status != 'pending',
+                                               PaymentRequest.updated_at < cutoff).all():
+        release_blob(payment.proof_blob)
+        payment.proof_blob = None
+        released += 1
+    db.session.flush()
+
+    # still over the size cap, drop the oldest raw copies until it fits
+    stored = db.session.query(func.coalesce(func.sum(Blob.size), 0)).filter(Blob.refcount > 0).scalar()
+    if stored > app.config['BLOB_STORE_MAX_BYTES']:
+        refs = dict(db.session.query(Blob.sha256, Blob.refcount).filter(Blob.refcount > 0))
+        oldest = (db.session.query(UploadFile, Blob.size)
+                  .join(Upload, Upload.id == UploadFile.upload_id)
+                  .join(Blob, Blob.sha256 == UploadFile.blob_sha256)
+                  .order_by(Upload.uploaded_at, UploadFile.id)
+                  .all())
+        for kept, size in oldest:
+            if stored <= app.config['BLOB_STORE_MAX_BYTES']:
+                break
+            release_blob(kept.blob_sha256)
+            db.session.delete(kept)
+            released += 1
+            refs[kept.blob_sha256] = refs.get(kept.blob_sha256, 1) - 1
+            if refs[kept.blob_sha256] == 0:
+                stored -= size
+    db.session.commit()
+
+    # unreferenced blobs, left alone for a grace period in case one is about to be used again
+    deleted = 0
+    grace_cutoff = now - timedelta(seconds=BLOB_GC_GRACE)
+    for (sha256,) in db.session.query(Blob.sha256).filter(Blob.refcount <= 0, Blob.updated_at < grace_cutoff).all():
+        gone = Blob.query.filter(Blob.sha256 == sha256, Blob.refcount <= 0).delete(synchronize_session=False)
+        db.session.commit()
+        if gone:
+            deleted += remove_stale_file(blob_path(sha256), grace_cutoff)
+
+    # files with no row: a crash between storing and committing, or old temp files
+    for entry in os.scandir(BLOB_FOLDER):
+        if entry.is_dir():
+            names = [child.name for child in os.scandir(entry.path)]
+            known = {sha256 for (sha256,) in db.session.query(Blob.sha256).filter(Blob.sha256.in_(names))}
+            for name in names:
+                if name not in known:
+                    deleted += remove_stale_file(os.path.join(entry.path, name), grace_cutoff)
+        elif entry.name.endswith('.tmp'):
+            deleted += remove_stale_file(entry.path, grace_cutoff)
+    return released, deleted
+
+# remove a file unless it was touched after cutoff, returns 1 if removed
+def remove_stale_file(path, cutoff):
+    try:
+        if datetime.utcfromtimestamp(os.stat(path).st_mtime) >= cutoff:
+            return 0
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+def blob_gc_loop():
+    while True:
+        time.sleep(app.config['BLOB_GC_INTERVAL'])
+        with app.app_context():
+            try:
+                released, deleted = collect_blobs()
+                if released or deleted:
+                    app.logger.info("Blob gc: %d references released, %d files deleted", released, deleted)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Blob gc failed")
+
+# every worker runs its own gc thread, started with its first request
+@app.before_request
+def start_blob_gc():
+    global blob_gc_thread
+    if blob_gc_thread is not None or app.config['BLOB_GC_INTERVAL'] <= 0:
+        return
+    with blob_gc_lock:
+        if blob_gc_thread is None:
+            blob_gc_thread = threading.Thread(target=blob_gc_loop, daemon=True)
+            blob_gc_thread.start()
+
+@app.cli.command('gc-blobs')
+def gc_blobs_command():
+    released, deleted = collect_blobs()
+    print(f"{released} references released, {deleted} files deleted.")
 
 # download pdf
 @app.route("/download", methods=["POST"])
 @login_required
 def download_report():
-    serialized = session.get("latest_summary")
-    mode = session.get("latest_mode", "date")
+    summary, mode = get_current_summary()
 
-    if not serialized:
+    if not summary:
         flash("No report generated yet.")
         return redirect(url_for("index"))
 
-    summary = deserialize_summary(serialized, mode)
-    report_stream = generate_excel_report(summary, mode)
+    if session.get('summary_job'):
+        flash("The full summary is still being built, try the download again in a moment.")
+        return redirect(url_for("index"))
+
+    report_stream = cached_export(
+        (current_summary_version(), mode, None, get_locale(), 'xlsx'),
+        lambda: generate_excel_report(summary, mode).getvalue(),
+    )
 
     # safe download name
     filename_map = {
@@ -658,8 +3238,7 @@ def download_report():
 @app.route("/clear", methods=["POST"])
 @login_required
 def clear_report():
-    session.pop('latest_summary', None)
-    session.pop('latest_mode', None)
+    clear_current_summary()
     flash("Report cleared.")
     return redirect(url_for("index"))
 
@@ -668,32 +3247,40 @@ def clear_report():
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    serialized = session.get("latest_summary")
-    mode = session.get("latest_mode", "date")
+    summary, mode = get_current_summary()
 
-    if not serialized:
+    if not summary:
         flash("No report generated yet.")
         return redirect(url_for("index"))
 
-    summary = deserialize_summary(serialized, mode)
+    def render():
+        # prepare data for chart
+        labels, data = summary_labels(summary, mode)
+        return render_template("dashboard.html", labels=labels, data=data, mode=mode)
 
-    # prepare data for chart
-    labels = []
-    data = []
-    if mode == "combined":
-        for key, total in summary.items():
-            labels.append(f"{key[0].strftime('%d/%m/%Y')} - {key[1]}")
-            data.append(total)
-    elif mode == "date":
-        for key, total in summary.items():
-            labels.append(key.strftime('%d/%m/%Y'))
-            data.append(total)
+    return conditional_summary_response(render)
+
+# etag/last-modified from the summary version, so a repeat view of the same
+# summary is a 304 and the page isn't rendered at all
+def conditional_summary_response(render):
+    version = current_summary_version()
+    if not version:
+        return render()
+
+    etag = hashlib.sha256(f"{current_user.id}:{version}".encode()).hexdigest()[:32]
+    last_modified = datetime.fromtimestamp(session.get('summary_updated', 0), timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
     else:
-        for key, total in summary.items():
-            labels.append(str(key))
-            data.append(total)
+        not_modified = bool(request.if_modified_since and request.if_modified_since >= last_modified)
 
-    return render_template("dashboard.html", labels=labels, data=data, mode=mode)
+    response = make_response('', 304) if not_modified else make_response(render())
+    # weak, the body differs once it's compressed
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 
@@ -701,50 +3288,32 @@ def dashboard():
 @app.route("/download_pdf", methods=["POST"])
 @login_required
 def download_pdf():
-    serialized = session.get("latest_summary")
-    mode = session.get("latest_mode", "date")
+    summary, mode = get_current_summary()
 
-    if not serialized:
+    if not summary:
         flash("No report generated yet.")
         return redirect(url_for("index"))
 
-    summary = deserialize_summary(serialized, mode)
+    if session.get('summary_job'):
+        flash("The full summary is still being built, try the download again in a moment.")
+        return redirect(url_for("index"))
 
     chart_image = request.form.get("chartImage")
     chart_type = request.form.get("chartType", "bar")
 
-    labels = []
-    data = []
-    for key, total in summary.items():
-        if mode == "date":
-            labels.append(key.strftime("%d/%m/%Y"))
-        elif mode == "combined":
-            labels.append(f"{key[0].strftime('%d/%m/%Y')} - {key[1]}")
-        else:
-            labels.append(str(key))
-        data.append(total)
-
-    summary_date = f"{labels[0]} to {labels[-1]}" if labels else "All data"
-    summary_rows = list(zip(labels, data))
-
-    rendered_HTML = render_template(
-        "dashboard_pdf.html",
-        labels=labels,
-        data=data,
-        mode=mode,
-        chart_type=chart_type,
-        summary_date=summary_date,
-        summary_rows=summary_rows,
-        chart_image=chart_image
+    # the chart is drawn by the browser, so its image is part of the key too
+    image_digest = hashlib.sha256(chart_image.encode('utf-8')).hexdigest() if chart_image else None
+    pdf = cached_export(
+        (current_summary_version(), mode, chart_type, get_locale(), 'pdf', image_digest),
+        lambda: generate_pdf_report(summary, mode, chart_type, chart_image, base_url=request.base_url),
     )
 
-    pdf = HTML(string=rendered_HTML, base_url=request.base_url).write_pdf()
-
-    response = make_response(pdf)
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = f"attachment; filename=sales_chart_{mode}_{chart_type}.pdf"
-
-    return response
+    return send_file(
+        pdf,
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"sales_chart_{mode}_{chart_type}.pdf"
+    )
 
 # show chart ewhen exportting to pdf
 @app.route("/chart_only/<type>")
@@ -761,22 +3330,175 @@ def my_uploads():
 
     return render_template("my_uploads.html", uploads=uploads)
 
+# query params for the history pages, returns (query, error)
+def history_query(values):
+    query = {
+        "from_date": values.get("from_date") or "",
+        "to_date": values.get("to_date") or "",
+        "item": (values.get("item") or "").strip(),
+        "group": values.get("group") if values.get("group") in HISTORY_GROUPS else "date",
+    }
+    try:
+        from_date = parse_date_flexible(query["from_date"]) if query["from_date"] else None
+        to_date = parse_date_flexible(query["to_date"]) if query["to_date"] else None
+    except ValueError as e:
+        return query, str(e)
+    if from_date and to_date and from_date > to_date:
+        return query, "The start date is after the end date."
+    query["range"] = (from_date, to_date)
+    return query, None
+
+def history_args(query):
+    return {key: query[key] for key in ("from_date", "to_date", "item", "group") if query[key]}
+
+# sales across all of a user's uploads, posting puts the result on the dashboard
+@app.route("/history", methods=["GET", "POST"])
+@login_required
+def sales_history():
+    query, error = history_query(request.values)
+    if error:
+        flash(error)
+        return redirect(url_for("sales_history"))
+
+    _, history = history_for(current_user.id)
+    group = query["group"]
+    summary = history.query(group, *query["range"], query["item"] or None)
+
+    if request.method == "POST":
+        if not summary:
+            flash("No sales match that query.")
+            return redirect(url_for("sales_history", **history_args(query)))
+        set_current_summary(serialize_summary(summary, group), group)
+        return redirect(url_for("dashboard"))
+
+    # which uploads couldn't take part in this query
+    left_out = []
+    if (query["item"] or group == "item") and history.mode_counts["date"]:
+        left_out.append(f"{history.mode_counts['date']} upload(s) by date only have no items")
+    if (query["from_date"] or query["to_date"] or group == "date") and history.mode_counts["item"]:
+        left_out.append(f"{history.mode_counts['item']} upload(s) by item only have no dates")
+
+    labels, data = summary_labels(summary, group)
+    return render_template(
+        "history.html",
+        rows=list(zip(labels, data)),
+        total=summary.total(),
+        query=query,
+        args=history_args(query),
+        item_names=history.item_names,
+        upload_count=sum(history.mode_counts.values()),
+        left_out=left_out,
+    )
+
+@app.route("/history/export")
+@login_required
+def export_history():
+    query, error = history_query(request.args)
+    if error:
+        flash(error)
+        return redirect(url_for("sales_history"))
+
+    version, history = history_for(current_user.id)
+    group = query["group"]
+    fmt = "csv" if request.args.get("format") == "csv" else "xlsx"
+    summary = history.query(group, *query["range"], query["item"] or None)
+    if not summary:
+        flash("No sales match that query.")
+        return redirect(url_for("sales_history", **history_args(query)))
+
+    build = generate_csv_report if fmt == "csv" else generate_excel_report
+    report_stream = cached_export(
+        ("history", version, group, query["from_date"], query["to_date"], query["item"], get_locale(), fmt),
+        lambda: build(summary, group).getvalue(),
+    )
+    mimetype = "text/csv" if fmt == "csv" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return send_file(report_stream, mimetype=mimetype, as_attachment=True,
+                     download_name=f"sales_history_{group}.{fmt}")
+
+# per user column mappings for header layouts detection gets wrong
+@app.route("/column_mappings", methods=["GET", "POST"])
+@login_required
+def column_mappings():
+    if request.method == "POST":
+        header_line = (request.form.get('header') or '').splitlines()
+        header_line = header_line[0].lstrip('\ufeff').strip() if header_line else ''
+        delimiter = {'comma': ',', 'semicolon': ';', 'tab': '\t'}.get(request.form.get('delimiter'))
+        date_format = request.form.get('date_format') or None
+
+        if not header_line or delimiter is None:
+            flash("Paste the header line of your file and pick its delimiter.")
+            return redirect(url_for('column_mappings'))
+        if date_format and date_format not in DATE_FORMATS:
+            flash("Unknown date format.")
+            return redirect(url_for('column_mappings'))
+
+        headers = [h.strip().lower() for h in next(csv.reader([header_line], delimiter=delimiter))]
+        columns = []
+        for field, label in (('date_column', 'Date'), ('item_column', 'Item'), ('amount_column', 'Amount')):
+            name = (request.form.get(field) or '').strip().lower()
+            if name not in headers:
+                flash(f"{label} column '{request.form.get(field) or ''}' is not in that header.")
+                return redirect(url_for('column_mappings'))
+            columns.append(headers.index(name))
+
+        signature = header_signature(header_line)
+        mapping = HeaderLayout.query.filter_by(signature=signature, user_id=current_user.id).first()
+        if mapping is None:
+            mapping = HeaderLayout(signature=signature, user_id=current_user.id)
+            db.session.add(mapping)
+        mapping.header = header_line
+        mapping.delimiter = delimiter
+        mapping.date_col, mapping.item_col, mapping.amount_col = columns
+        mapping.date_format = date_format
+        db.session.commit()
+        forget_header_layout(signature)
+
+        flash("Column mapping saved.")
+        return redirect(url_for('column_mappings'))
+
+    mappings = HeaderLayout.query.filter_by(user_id=current_user.id).order_by(HeaderLayout.created_at.desc()).all()
+    return render_template("column_mappings.html", mappings=mappings, date_formats=DATE_FORMATS)
+
+@app.route("/column_mappings/<int:mapping_id>/delete", methods=["POST"])
+@login_required
+def delete_column_mapping(mapping_id):
+    mapping = HeaderLayout.query.filter_by(id=mapping_id, user_id=current_user.id).first_or_404()
+    signature = mapping.signature
+    db.session.delete(mapping)
+    db.session.commit()
+    forget_header_layout(signature)
+    flash("Column mapping removed.")
+    return redirect(url_for('column_mappings'))
+
 # load previosu saved report
 @app.route("/download_old_report/<int:upload_id>")
 @login_required
 def download_old_report(upload_id):
     upload = Upload.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
-    filename = secure_filename(upload.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-    if not os.path.exists(filepath):
-        flash("Original file not found. Please re-upload to regenerate report.", "warning")
-        return redirect(url_for("my_uploads"))
-
-    with open(filepath, 'rb') as f:
-        summary = load_sales_data(f, mode=upload.mode)
-
-    report_stream = generate_excel_report(summary, mode=upload.mode)
+    # use the stored aggregate, only older uploads need the original file
+    file_summary = latest_file_summary(upload)
+    if file_summary and file_summary.summary_text:
+        version = summary_digest(file_summary.summary_text, upload.mode)
+        report_stream = cached_export(
+            (version, upload.mode, None, get_locale(), 'xlsx'),
+            lambda: generate_excel_report(
+                load_summary(version, upload.mode, lambda: json.loads(file_summary.summary_text)), mode=upload.mode
+            ).getvalue(),
+        )
+    else:
+        raw_file = upload_raw_file(upload)
+        if raw_file is None:
+            flash("Original file not found. Please re-upload to regenerate report.", "warning")
+            return redirect(url_for("my_uploads"))
+        filename, filepath = raw_file
+
+        with open(filepath, 'rb') as f:
+            if filename.lower().endswith('.xlsx'):
+                summary = load_sales_workbook(f, mode=upload.mode)
+            else:
+                summary = load_sales_data(f, mode=upload.mode, compression=upload_compression(filename))
+        report_stream = generate_excel_report(summary, mode=upload.mode)
 
     download_name = f"{upload.filename}_summary.xlsx"
 
@@ -807,20 +3529,25 @@ def upgrade_manual():
             
             # Then check file extension
             if proof.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.pdf')):
-                filename = f"{current_user.id}_{uuid.uuid4().hex}_{secure_filename(proof.filename)}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                proof.save(filepath)
+                # same file sent twice is stored once
+                tmp_path = blob_tmp_path()
+                proof.save(tmp_path)
+                sha256, size = put_blob(tmp_path)
+                retain_blob(sha256, size)
                 
                 # save payment request to DB
                 payment_request = PaymentRequest(
                     user_id=current_user.id,
                     amount=PREMIUM_PRICE,
                     currency="BND",
-                    proof_filename=filename,
+                    proof_filename=secure_filename(proof.filename) or "proof",
+                    proof_blob=sha256,
                     status="pending"
                 )
                 db.session.add(payment_request)
+                bump_admin_stats(pending_payments=1)
                 db.session.commit()
+                forget_user(current_user.id)
 
                 # email msg
                 msg = Message(
@@ -853,6 +3580,38 @@ def upgrade_manual():
     }
     return render_template("upgrade_manual.html", bank_info=bank_info)
 
+# approve/reject pending requests, approving upgrades the user. the stats
+# follow in the same transaction, the caller commits
+PAYMENT_DECISIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+def decide_payments(payments, status):
+    newly_premium = 0
+    for payment in payments:
+        payment.status = status
+        if status == 'approved':
+            if payment.user.plan != 'premium':
+                newly_premium += 1
+            payment.user.plan = 'premium'
+
+    if status == 'approved':
+        bump_admin_stats(pending_payments=-len(payments), approved_payments=len(payments),
+                         approved_amount=sum(payment.amount for payment in payments), premium_users=newly_premium)
+    else:
+        bump_admin_stats(pending_payments=-len(payments), rejected_payments=len(payments))
+
+def payment_decision_message(payment):
+    if payment.status == 'approved':
+        return Message(
+            subject="Payment Approved - Your Account Upgraded",
+            recipients=[payment.user.email],
+            body=f"Hi {payment.user.username},\n\nYour payment has been approved and your account upgraded to premium. Enjoy!\n\nThanks,\nbat2025"
+        )
+    return Message(
+        subject="Payment Rejected",
+        recipients=[payment.user.email],
+        body=f"Hi {payment.user.username},\n\nUnfortunately, your payment proof was rejected. Please try again or contact support.\n\nThanks,\nbat2025"
+    )
+
 # to accept payment
 @app.route('/admin/payment_request/<int:request_id>/approve', methods=['POST'])
 @login_required
@@ -863,17 +3622,12 @@ def approve_payment(request_id):
         flash('Payment request already processed.', 'warning')
         return redirect(url_for('admin'))
 
-    payment.status = 'approved'
-    payment.user.plan = 'premium'
+    decide_payments([payment], 'approved')
     db.session.commit()
+    forget_user(payment.user_id)
 
     # Send approval email
-    msg = Message(
-        subject="Payment Approved - Your Account Upgraded",
-        recipients=[payment.user.email],
-        body=f"Hi {payment.user.username},\n\nYour payment has been approved and your account upgraded to premium. Enjoy!\n\nThanks,\nbat2025"
-    )
-    mail.send(msg)
+    mail.send(payment_decision_message(payment))
 
     flash(f'User {payment.user.username} upgraded to premium!', 'success')
     return redirect(url_for('admin'))
@@ -887,20 +3641,59 @@ def reject_payment(request_id):
     if payment.status != 'pending':
         flash(f'Payment request #{request_id} has already been processed.', 'warning')
         return redirect(url_for('admin'))
-    payment.status = 'rejected'
+    decide_payments([payment], 'rejected')
     db.session.commit()
+    forget_user(payment.user_id)
 
     # send rejection email
-    msg = Message(
-        subject="Payment Rejected",
-        recipients=[payment.user.email],
-        body=f"Hi {payment.user.username},\n\nUnfortunately, your payment proof was rejected. Please try again or contact support.\n\nThanks,\nbat2025"
-    )
-    mail.send(msg)
+    mail.send(payment_decision_message(payment))
 
     flash(f'Payment request #{request_id} rejected', 'success')
     return redirect(url_for('admin'))
 
+# approve/reject many requests at once: one transaction for every row,
+# then all the emails over a single smtp connection
+@app.route('/admin/payment_requests/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_payment_requests():
+    status = PAYMENT_DECISIONS.get(request.form.get('action'))
+    request_ids = set(request.form.getlist('request_ids', type=int))
+    if not status or not request_ids:
+        flash('Select some payment requests and an action.', 'warning')
+        return redirect(url_for('admin'))
+
+    # rows are locked so two admins can't both process the same request
+    payments = (PaymentRequest.query
+                .options(joinedload(PaymentRequest.user))
+                .filter(PaymentRequest.id.in_(request_ids), PaymentRequest.status == 'pending')
+                .order_by(PaymentRequest.id)
+                .with_for_update(of=PaymentRequest)
+                .all())
+    if not payments:
+        flash('Those payment requests have already been processed.', 'warning')
+        return redirect(url_for('admin'))
+
+    decide_payments(payments, status)
+    db.session.commit()
+    for user_id in {payment.user_id for payment in payments}:
+        forget_user(user_id)
+
+    flash(f'{len(payments)} payment request(s) {status}.', 'success')
+    if len(payments) < len(request_ids):
+        flash(f'{len(request_ids) - len(payments)} were already processed and left as they were.', 'warning')
+
+    # the decisions are saved either way, a mail failure only loses the notifications
+    try:
+        with mail.connect() as connection:
+            for payment in payments:
+                connection.send(payment_decision_message(payment))
+    except Exception:
+        app.logger.exception("Sending payment decision emails failed")
+        flash('The notification emails could not be sent.', 'warning')
+
+    return redirect(url_for('admin'))
+
 # to upgrade page
 @app.route("/process_upgrade", methods=["POST"])
 @login_required
@@ -924,7 +3717,9 @@ def process_upgrade():
         status="pending"
     )
     db.session.add(new_request)
+    bump_admin_stats(pending_payments=1)
     db.session.commit()
+    forget_user(current_user.id)
 
     flash("Upgrade request submitted! Please wait for admin approval.", "info")
     return redirect(url_for("index"))
@@ -952,16 +3747,116 @@ def terms():
     return render_template("terms.html")
 
 # sec things
+# compress text responses, brotli if the client takes it, gzip otherwise.
+# downloads and static files are streamed from disk and left alone
+COMPRESS_MIN_SIZE = 500
+COMPRESS_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'image/svg+xml',
+}
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding == 'br':
+        # lower quality, the default 11 is far too slow per request
+        data = brotli.compress(data, quality=5)
+    elif encoding == 'gzip':
+        data = gzip.compress(data, compresslevel=6)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.after_request
 def add_csp_header(response):
     response.headers['Content-Security-Policy'] = (
         "default-src 'self'; "
         "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
         "font-src 'self' https://fonts.gstatic.com; "
-        "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net;"
+        "script-src 'self' 'unsafe-inline';"
     )
     return response
 
+# static files are linked as name.<content hash>.ext, so they can be cached
+# for a year and a deploy just changes the name. contents (and compressed
+# copies) are kept in memory and reloaded when the file on disk changes
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+FINGERPRINTED_NAME = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)$')
+static_assets = {}
+static_assets_lock = threading.Lock()
+
+def static_asset(filename):
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    mtime = os.path.getmtime(path)
+    with static_assets_lock:
+        asset = static_assets.get(filename)
+    if asset is None or asset['mtime'] != mtime:
+        with open(path, 'rb') as f:
+            data = f.read()
+        asset = {'mtime': mtime, 'hash': hashlib.sha256(data).hexdigest()[:12], 'data': data, 'encoded': {}}
+        with static_assets_lock:
+            static_assets[filename] = asset
+    return asset
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        asset = static_asset(values['filename'])
+        if asset:
+            root, ext = os.path.splitext(values['filename'])
+            values['filename'] = f"{root}.{asset['hash']}{ext}"
+
+def serve_static(filename):
+    match = FINGERPRINTED_NAME.match(filename)
+    name = match.group(1) + match.group(3) if match else filename
+    asset = static_asset(name)
+    if asset is None:
+        abort(404)
+
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    data, encoding = asset['data'], None
+    compressible = mimetype in COMPRESS_MIMETYPES and len(data) >= COMPRESS_MIN_SIZE
+    if compressible:
+        encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+        if encoding:
+            encoded = asset['encoded'].get(encoding)
+            if encoded is None:
+                # once per file, so it's worth squeezing harder than for pages
+                encoded = brotli.compress(data, quality=9) if encoding == 'br' else gzip.compress(data, compresslevel=9)
+                asset['encoded'][encoding] = encoded
+            data = encoded
+
+    response = app.response_class(data, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    response.set_etag(asset['hash'] + (f'-{encoding}' if encoding else ''))
+    if match and match.group(2) == asset['hash']:
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    else:
+        # unversioned or stale link, revalidate
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+app.view_functions['static'] = serve_static
+
 # to uploads proof 
 @app.route('/uploads/<filename>')
 @login_required
@@ -970,6 +3865,26 @@ def uploaded_file(filename):
         abort(403)
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/admin/payment_request/<int:request_id>/proof')
+@login_required
+@admin_required
+def payment_proof(request_id):
+    return send_payment_proof(PaymentRequest.query.get_or_404(request_id))
+
+# the user's own proof, linked from their payment status page
+@app.route('/payment_status/<int:request_id>/proof')
+@login_required
+def own_payment_proof(request_id):
+    return send_payment_proof(PaymentRequest.query.filter_by(id=request_id, user_id=current_user.id).first_or_404())
+
+def send_payment_proof(payment):
+    if payment.proof_blob:
+        return send_blob(payment.proof_blob, payment.proof_filename)
+    if payment.proof_filename:
+        # sent before the blob store
+        return send_from_directory(app.config['UPLOAD_FOLDER'], payment.proof_filename)
+    abort(404)
+
 
 # 404 - Page Not Found
 @app.errorhandler(404)
@@ -0,0 +1,287 @@
+# end-to-end load test
+# starts the app on a local sqlite db + stub smtp server and drives it with
+# concurrent virtual users, then prints p50/p95/p99 latency and req/s per endpoint
+#
+#   python loadtest.py --concurrency 1,4,16 --iterations 5 --rows 2000
+#
+# everything runs on 127.0.0.1, no network access needed
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+ENDPOINTS = ["signup", "login", "index", "dashboard", "download", "download_pdf"]
+MODES = ["date", "item", "combined"]
+
+
+# stub smtp server, accepts everything and just counts messages
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 loadtest stub smtp\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.wfile.write(b"250 loadtest\r\n")
+            elif command == b"DATA":
+                self.wfile.write(b"354 end data with <CR><LF>.<CR><LF>\r\n")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.wfile.write(b"250 queued\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 ok\r\n")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubSMTPHandler)
+        self.messages = 0
+        self.lock = threading.Lock()
+
+
+# fake sales csv so upload size can be tuned
+def make_csv(rows, items=50, days=90, seed=1):
+    rng = random.Random(seed)
+    start = date(2025, 1, 1)
+    lines = ["Date,Item,Amount"]
+    for _ in range(rows):
+        day = start + timedelta(days=rng.randrange(days))
+        lines.append(f"{day.strftime('%d/%m/%Y')},Item {rng.randrange(items)},{rng.uniform(1, 500):.2f}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n'.encode("utf-8") + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+# one virtual user, keeps its own cookies
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, body=None, content_type=None):
+        # talisman redirects plain http to https, so pretend we're behind a tls proxy
+        headers = {"X-Forwarded-Proto": "https"}
+        if content_type:
+            headers["Content-Type"] = content_type
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+
+        for header in response.msg.get_all("Set-Cookie") or []:
+            name, _, rest = header.partition("=")
+            value = rest.split(";", 1)[0]
+            if value:
+                self.cookies[name.strip()] = value
+            else:
+                self.cookies.pop(name.strip(), None)
+        return response.status, response.getheader("Location"), data
+
+    def post_form(self, path, fields):
+        return self.request("POST", path, urlencode(fields), "application/x-www-form-urlencoded")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def timed(self, endpoint, call, ok=lambda status, location: status < 400):
+        started = time.perf_counter()
+        try:
+            status, location, _ = call()
+            success = ok(status, location)
+        except Exception:
+            success = False
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.timings[endpoint].append(elapsed)
+            if not success:
+                self.errors[endpoint] += 1
+        return success
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_user(app_module, host, port, recorder, iterations, csv_bytes, index):
+    client = Client(host, port)
+    username = f"load_{index}_{uuid.uuid4().hex[:8]}"
+    password = "loadtest-pw"
+
+    recorder.timed("signup", lambda: client.post_form(
+        "/signup", {"username": username, "email": f"{username}@example.test", "password": password}))
+
+    # load users are premium so the free plan upload limit doesn't cut the run short
+    with app_module.app.app_context():
+        user = app_module.User.query.filter_by(username=username).first()
+        if user:
+            user.plan = "premium"
+            app_module.db.session.commit()
+
+    logged_in = recorder.timed(
+        "login",
+        lambda: client.post_form("/login", {"username": username, "password": password}),
+        ok=lambda status, location: status == 302 and bool(location) and "/login" not in location,
+    )
+    if not logged_in:
+        return
+
+    for i in range(iterations):
+        body, content_type = encode_multipart({"mode": MODES[i % len(MODES)]}, {"file": ("loadtest.csv", csv_bytes)})
+        recorder.timed("index", lambda: client.request("POST", "/index", body, content_type))
+        recorder.timed("dashboard", lambda: client.request("GET", "/dashboard"))
+        recorder.timed("download", lambda: client.request("POST", "/download"))
+        recorder.timed("download_pdf", lambda: client.post_form("/download_pdf", {"chartType": "bar"}))
+
+
+def start_app(workdir, smtp_port):
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    os.environ.setdefault("SECRET_KEY", "loadtest-secret")
+    os.environ["ADMIN_PASSWORD"] = "loadtest-admin"
+    os.environ["MAIL_SERVER"] = "127.0.0.1"
+    os.environ["MAIL_PORT"] = str(smtp_port)
+    os.environ["MAIL_USE_TLS"] = "false"
+    os.environ["MAIL_DEFAULT_SENDER"] = "loadtest@example.test"
+    # every virtual user comes from 127.0.0.1, don't let the per ip hashing limit throttle them
+    os.environ.setdefault("PASSWORD_HASH_PER_IP", "1000")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    # per request logging would swamp the report
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        app_module.create_admin_user()
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return app_module, server
+
+
+def print_report(concurrency, wall, recorder):
+    print(f"\nconcurrency={concurrency}  wall={wall:.2f}s")
+    print(f"{'endpoint':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    rows = {}
+    for endpoint in ENDPOINTS:
+        values = sorted(recorder.timings.get(endpoint, []))
+        if not values:
+            continue
+        row = {
+            "count": len(values),
+            "errors": recorder.errors.get(endpoint, 0),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "rps": len(values) / wall if wall else 0.0,
+        }
+        rows[endpoint] = row
+        print(f"{endpoint:<14}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['rps']:>9.1f}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test against a local instance")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--iterations", type=int, default=3, help="upload/dashboard/download rounds per user")
+    parser.add_argument("--rows", type=int, default=1000, help="rows in the generated csv")
+    parser.add_argument("--csv", help="upload this csv instead of a generated one")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    if args.csv:
+        with open(args.csv, "rb") as f:
+            csv_bytes = f.read()
+    else:
+        csv_bytes = make_csv(args.rows)
+
+    smtp = StubSMTPServer()
+    threading.Thread(target=smtp.serve_forever, daemon=True).start()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="salesviz-loadtest-") as workdir:
+        app_module, server = start_app(workdir, smtp.server_address[1])
+        host, port = server.server_address[:2]
+        print(f"app on http://{host}:{port}, smtp stub on port {smtp.server_address[1]}, "
+              f"csv {len(csv_bytes)} bytes")
+
+        try:
+            for concurrency in levels:
+                recorder = Recorder()
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    futures = [
+                        pool.submit(run_user, app_module, host, port, recorder, args.iterations, csv_bytes, n)
+                        for n in range(concurrency)
+                    ]
+                    for future in futures:
+                        future.result()
+                wall = time.perf_counter() - started
+                results[concurrency] = print_report(concurrency, wall, recorder)
+        finally:
+            server.shutdown()
+            smtp.shutdown()
+
+    print(f"\nstub smtp received {smtp.messages} messages")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
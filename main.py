@@ -1,97 +1,187 @@
-from flask import Flask, render_template, request, send_file
-import csv
-from collections import defaultdict
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, numbers
-import io
-
-app = Flask(__name__)
-
-def load_sales_data(file_stream):
-    sales = defaultdict(float)
-    file_stream.seek(0)
-    reader = csv.DictReader(io.StringIO(file_stream.read().decode('utf-8')))
-    for row in reader:
-        item = row['item'].strip()
-        if not item:
-            continue
-        amount = float(row['amount'])
-        sales[item] += amount
-    return sales
-
-def generate_excel_report(summary):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Sales Summary"
-
-    # header row
-    ws.append(["Item", "Total Sales ($)"])
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal="center")
-
-    # data rows
-    for item, total in summary.items():
-        ws.append([item, total])
-
-    # format currency and center align
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=2, max_col=2):
-        for cell in row:
-            cell.number_format = numbers.FORMAT_CURRENCY_USD_SIMPLE
-            cell.alignment = Alignment(horizontal="center")
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=1):
-        for cell in row:
-            cell.alignment = Alignment(horizontal="center")
-
-    # auto-adjust column widths
-    for col in ws.columns:
-        max_length = max(len(str(cell.value)) for cell in col)
-        column_letter = col[0].column_letter
-        ws.column_dimensions[column_letter].width = max_length + 2
-
-    # save to BytesIO for sending as download
-    excel_stream = io.BytesIO()
-    wb.save(excel_stream)
-    excel_stream.seek(0)
-    return excel_stream
-
-@app.route("/", methods=["GET", "POST"])
-def index():
-    summary = None
-    error = None
-    if request.method == "POST":
-        file = request.files.get("file")
-        if not file or file.filename == "":
-            error = "Please upload a CSV file."
-        else:
-            try:
-                sales = load_sales_data(file.stream)
-                summary = dict(sales)
-            except Exception as e:
-                error = f"Error processing file: {e}"
+# offline batch reports
+# runs a folder of csv files through the same ingestion + report code as the web app
+#
+#   python main.py exports/ -o reports/ --mode date,item --format xlsx,csv,pdf
+#
+# files whose content hasn't changed since the last run are skipped
+# (tracked in <output>/.manifest.json), so this is cheap to run nightly
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# the app wants a database at import time, reports don't touch it
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+
+from app import (
+    app,
+    READ_CHUNK_SIZE,
+    SalesAggregator,
+    SpilledSummary,
+    generate_csv_report,
+    generate_excel_report,
+    generate_pdf_report,
+    parse_date_flexible,
+)
+
+MODES = ["date", "item", "combined"]
+FORMATS = ["xlsx", "csv", "pdf"]
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    return render_template("index.html", summary=summary, error=error)
 
-@app.route("/download", methods=["POST"])
-def download():
+def output_paths(name, output_dir, modes, formats):
+    stem = os.path.splitext(name)[0]
+    return [os.path.join(output_dir, f"{stem}_{mode}.{fmt}") for mode in modes for fmt in formats]
 
-    file = request.files.get("file")
-    if not file or file.filename == "":
-        return "No file uploaded", 400
 
+def write_report(summary, mode, fmt, path):
+    if fmt == "xlsx":
+        data = generate_excel_report(summary, mode).getvalue()
+    elif fmt == "csv":
+        data = generate_csv_report(summary, mode).getvalue()
+    else:
+        with app.app_context():
+            data = generate_pdf_report(summary, mode)
+
+    # write then rename so a crash never leaves half a report behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# runs in a worker process
+def process_file(path, output_dir, modes, formats, from_date, to_date, previous, max_keys=None):
+    name = os.path.basename(path)
+    checksum = file_sha256(path)
+    outputs = output_paths(name, output_dir, modes, formats)
+
+    if previous and previous.get("sha256") == checksum and all(os.path.exists(p) for p in outputs):
+        return {"name": name, "sha256": checksum, "skipped": True}
+
+    # one pass over the file feeds every requested mode
+    aggregators = {
+        mode: SalesAggregator(mode=mode, from_date=from_date, to_date=to_date, max_keys=max_keys,
+                              vectorize_rows=app.config["VECTORIZE_MIN_ROWS"],
+                              exact_cents=app.config["EXACT_CENTS"])
+        for mode in modes
+    }
     try:
-        sales = load_sales_data(file.stream)
-        summary = dict(sales)
-        excel_stream = generate_excel_report(summary)
-        return send_file(
-            excel_stream,
-            download_name="sales_summary_report.xlsx",
-            as_attachment=True,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                for aggregator in aggregators.values():
+                    aggregator.feed(chunk)
+        for aggregator in aggregators.values():
+            aggregator.close()
+
+        stem = os.path.splitext(name)[0]
+        for mode, aggregator in aggregators.items():
+            summary = aggregator.result()
+            try:
+                for fmt in formats:
+                    write_report(summary, mode, fmt, os.path.join(output_dir, f"{stem}_{mode}.{fmt}"))
+            finally:
+                if isinstance(summary, SpilledSummary):
+                    summary.close()
     except Exception as e:
-        return f"Error generating report: {e}", 500
+        return {"name": name, "error": str(e)}
+
+    first = next(iter(aggregators.values()))
+    return {
+        "name": name,
+        "sha256": checksum,
+        "skipped": False,
+        "skipped_rows": first.skipped_rows,
+        "outputs": outputs,
+    }
+
+
+def parse_list(value, allowed, label):
+    items = [v.strip().lower() for v in value.split(",") if v.strip()]
+    unknown = [v for v in items if v not in allowed]
+    if unknown or not items:
+        raise argparse.ArgumentTypeError(f"unknown {label}: {', '.join(unknown) or value}")
+    return items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate sales summary reports for a folder of CSV files")
+    parser.add_argument("input_dir", help="folder with the .csv files")
+    parser.add_argument("-o", "--output", default="reports", help="where reports are written (default: reports)")
+    parser.add_argument("--mode", default="date", type=lambda v: parse_list(v, MODES, "mode"),
+                        help="comma separated: date, item, combined")
+    parser.add_argument("--format", default="xlsx", type=lambda v: parse_list(v, FORMATS, "format"),
+                        help="comma separated: xlsx, csv, pdf")
+    parser.add_argument("--from-date", help="only include sales on or after this date")
+    parser.add_argument("--to-date", help="only include sales on or before this date")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parallel worker processes")
+    parser.add_argument("--memory-budget", type=int, default=app.config["COMBINED_MEMORY_BUDGET"],
+                        help="combined mode keys kept in memory before spilling to disk")
+    parser.add_argument("--force", action="store_true", help="rebuild reports even if the input is unchanged")
+    args = parser.parse_args(argv)
+
+    from_date = parse_date_flexible(args.from_date) if args.from_date else None
+    to_date = parse_date_flexible(args.to_date) if args.to_date else None
+
+    inputs = sorted(
+        os.path.join(args.input_dir, name)
+        for name in os.listdir(args.input_dir)
+        if name.lower().endswith(".csv") and os.path.isfile(os.path.join(args.input_dir, name))
+    )
+    if not inputs:
+        print(f"No .csv files found in {args.input_dir}")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path) and not args.force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # settings are part of the key, changing them rebuilds everything
+    settings = {"modes": args.mode, "formats": args.format, "from_date": args.from_date, "to_date": args.to_date}
+    if manifest.get("settings") != settings:
+        manifest = {}
+    files = manifest.get("files", {})
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(inputs)))) as pool:
+        futures = [
+            pool.submit(process_file, path, args.output, args.mode, args.format,
+                        from_date, to_date, files.get(os.path.basename(path)), args.memory_budget)
+            for path in inputs
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            name = result["name"]
+            if "error" in result:
+                failed += 1
+                files.pop(name, None)
+                print(f"{name}: error: {result['error']}")
+            elif result["skipped"]:
+                print(f"{name}: unchanged, skipped")
+            else:
+                files[name] = {"sha256": result["sha256"]}
+                note = f" ({result['skipped_rows']} invalid rows skipped)" if result["skipped_rows"] else ""
+                print(f"{name}: wrote {len(result['outputs'])} reports{note}")
+
+    with open(manifest_path, "w") as f:
+        json.dump({"settings": settings, "files": files}, f, indent=2)
+
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    sys.exit(main())
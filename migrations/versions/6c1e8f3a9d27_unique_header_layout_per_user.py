@@ -0,0 +1,33 @@
+"""Unique header layout per signature and user, drop shared date formats
+
+Revision ID: 6c1e8f3a9d27
+Revises: b7c31e58a2d4
+Create Date: 2026-10-19 21:05:12.418733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1e8f3a9d27'
+down_revision = 'b7c31e58a2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared layouts no longer carry a date format, and keep only the
+    # newest per-user row before adding the constraint
+    op.execute("UPDATE header_layout SET date_format = NULL WHERE user_id IS NULL")
+    op.execute(
+        "DELETE FROM header_layout WHERE user_id IS NOT NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM header_layout WHERE user_id IS NOT NULL GROUP BY signature, user_id)"
+    )
+    with op.batch_alter_table('header_layout', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_header_layout_signature_user', ['signature', 'user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('header_layout', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_header_layout_signature_user', type_='unique')
@@ -10,9 +10,11 @@ document.addEventListener("DOMContentLoaded", function () {
   if (fileInput && fileNameSpan) {
     fileInput.addEventListener('change', function () {
       console.log("File changed");
-      fileNameSpan.textContent = fileInput.files.length > 0
-        ? `Selected: ${fileInput.files[0].name}`
-        : "No file chosen";
+      fileNameSpan.textContent = fileInput.files.length > 1
+        ? `Selected: ${fileInput.files.length} files`
+        : fileInput.files.length > 0
+          ? `Selected: ${fileInput.files[0].name}`
+          : "No file chosen";
     });
   } else {
     console.warn("fileInput or fileNameSpan not found, skipping file input setup.");
@@ -34,6 +36,183 @@ document.addEventListener("DOMContentLoaded", function () {
     });
   }
 
+  // chunked upload for big files
+  const uploadForm = document.getElementById('uploadForm');
+  const chunkThreshold = Number(uploadForm?.dataset.chunkThreshold || 0);
+
+  async function sha256Hex(blob) {
+    if (!window.crypto?.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  async function chunkedUpload(form, file) {
+    const fields = new FormData(form);
+    const resumeKey = `chunkedUpload:${file.name}:${file.size}:${file.lastModified}`;
+    let uploadId = localStorage.getItem(resumeKey);
+    let chunkSize = 0;
+    let offset = 0;
+
+    // pick up where a previous attempt stopped
+    if (uploadId) {
+      const res = await fetch(`/upload/chunked/${uploadId}`).catch(() => null);
+      if (res && res.ok) {
+        offset = (await res.json()).offset;
+        chunkSize = Number(localStorage.getItem(`${resumeKey}:chunkSize`));
+      } else {
+        uploadId = null;
+      }
+    }
+
+    if (!uploadId || !chunkSize) {
+      const res = await fetch('/upload/chunked', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          filename: file.name,
+          size: file.size,
+          mode: fields.get('mode'),
+          from_date: fields.get('from_date'),
+          to_date: fields.get('to_date'),
+          append_to: fields.get('append_to'),
+          replace_dates: fields.get('replace_dates'),
+          progress_id: fields.get('progress_id')
+        })
+      });
+      const info = await res.json();
+      if (!res.ok) {
+        location.href = info.redirect || '/index';
+        return;
+      }
+      uploadId = info.upload_id;
+      chunkSize = info.chunk_size;
+      offset = info.offset;
+      localStorage.setItem(resumeKey, uploadId);
+      localStorage.setItem(`${resumeKey}:chunkSize`, chunkSize);
+    }
+
+    let retries = 0;
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + chunkSize);
+      if (fileNameSpan) {
+        fileNameSpan.textContent = `Uploading ${file.name}: ${Math.floor(offset * 100 / file.size)}%`;
+      }
+      try {
+        const headers = {};
+        const checksum = await sha256Hex(chunk);
+        if (checksum) headers['X-Chunk-Sha256'] = checksum;
+
+        const res = await fetch(`/upload/chunked/${uploadId}?offset=${offset}`, { method: 'PUT', headers, body: chunk });
+        const body = await res.json();
+        if (res.status === 409) {
+          offset = body.offset;
+          continue;
+        }
+        if (!res.ok && !body.redirect) throw new Error(body.error);
+        if (!res.ok || body.done) {
+          localStorage.removeItem(resumeKey);
+          localStorage.removeItem(`${resumeKey}:chunkSize`);
+          location.href = body.redirect;
+          return;
+        }
+        offset = body.offset;
+        retries = 0;
+      } catch (err) {
+        // connection dropped, ask the server how much it has
+        if (++retries > 5) {
+          alert("Upload failed, please try again.");
+          return;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+        const res = await fetch(`/upload/chunked/${uploadId}`).catch(() => null);
+        if (res && res.ok) offset = (await res.json()).offset;
+      }
+    }
+  }
+
+  // smaller files are sent as the raw request body so the server can parse as it reads
+  async function streamUpload(form, file) {
+    const fields = new FormData(form);
+    const params = new URLSearchParams({ filename: file.name });
+    for (const name of ['mode', 'from_date', 'to_date', 'append_to', 'replace_dates', 'progress_id']) {
+      const value = fields.get(name);
+      if (value) params.set(name, value);
+    }
+    if (fileNameSpan) fileNameSpan.textContent = `Uploading ${file.name}...`;
+
+    try {
+      const res = await fetch(`/upload/stream?${params}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'text/csv' },
+        body: file
+      });
+      const body = await res.json();
+      if (!res.ok && !body.redirect) throw new Error(body.error);
+      location.href = body.redirect;
+    } catch (err) {
+      alert(err.message || "Upload failed, please try again.");
+    }
+  }
+
+  // live progress, pushed by the server as server-sent events
+  const STAGE_LABELS = { uploading: 'Uploading', parsing: 'Reading', saving: 'Saving', done: 'Done', error: 'Failed' };
+
+  function watchProgress(progressId, onState) {
+    if (!progressId || !window.EventSource) return null;
+    const source = new EventSource(`/progress/${progressId}`);
+    source.onmessage = e => {
+      const state = JSON.parse(e.data);
+      if (state.stage === 'done' || state.stage === 'error') source.close();
+      onState(state);
+    };
+    return source;
+  }
+
+  function describeProgress(state) {
+    const parts = [STAGE_LABELS[state.stage] || state.stage];
+    if (state.bytes_read != null && state.total_bytes) {
+      parts.push(`${Math.min(100, Math.floor(state.bytes_read * 100 / state.total_bytes))}%`);
+    }
+    if (state.rows_read != null) parts.push(`${state.rows_read.toLocaleString()} rows`);
+    if (state.skipped_rows) parts.push(`${state.skipped_rows.toLocaleString()} skipped`);
+    if (state.message) parts.push(state.message);
+    return parts.join(' · ');
+  }
+
+  // a preview is showing, reload once the full summary is in
+  const previewNote = document.getElementById('previewNote');
+  watchProgress(previewNote?.dataset.progressId, state => {
+    if (state.stage === 'done' || state.stage === 'error') {
+      location.reload();
+      return;
+    }
+    const span = previewNote.querySelector('.preview-progress');
+    if (span) span.textContent = describeProgress(state);
+  });
+
+  if (uploadForm) {
+    uploadForm.addEventListener('submit', function (e) {
+      const progressInput = document.getElementById('progressId');
+      if (progressInput && window.crypto?.randomUUID) {
+        progressInput.value = crypto.randomUUID().replace(/-/g, '');
+        watchProgress(progressInput.value, state => {
+          if (fileNameSpan) fileNameSpan.textContent = describeProgress(state);
+        });
+      }
+
+      const files = document.getElementById('csvFile')?.files || [];
+      const file = files[0];
+      // only single (optionally compressed) csv files go through the chunked/streamed paths
+      if (!chunkThreshold || files.length !== 1 || !/\.csv(\.(gz|bz2|xz))?$/i.test(file.name)) return;
+      e.preventDefault();
+      if (file.size > chunkThreshold) {
+        chunkedUpload(uploadForm, file);
+      } else {
+        streamUpload(uploadForm, file);
+      }
+    });
+  }
+
   // chart setup
   const canvas = document.getElementById("salesChart");
   if (!canvas) {